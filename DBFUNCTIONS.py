@@ -1,119 +1,72 @@
+import argparse
 import logging
+import shlex
+import sys
 import time
-import boto3
+from boto3.dynamodb.conditions import Key
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+import aws_clients
+import dynamodb_batch
+import dynamodb_paging
+import dynamodb_sharding
+import dynamodb_tables
 from botocore.exceptions import ClientError
-# create a DynamoDB client
-dynamodb = boto3.client("dynamodb")
 TABLE_NAME = 'DogToys'
 INDEX_NAME_DT = 'DogToysidIndex'
 INDEX_NAME_P = 'PriceIdIndex'
+# Shards per category on the GSIs, 0 = unsharded (see dynamodb_sharding)
+GSI_SHARDS = 0
 
-def create_table():
+def create_table(billing_mode=dynamodb_tables.PROVISIONED):
 
     try:
-        db_client = boto3.client('dynamodb')
-        db_client.create_table(
-          AttributeDefinitions=[
-             {
-                  'AttributeName': 'pk',
-                  'AttributeType': 'S',
-              },
-              {
-                  'AttributeName': 'sk',
-                  'AttributeType': 'S',
-              },
-              {
-                  'AttributeName': 'price',
-                  'AttributeType': 'N',
-              }
-          ],
-          KeySchema=[
-              {
-                  'AttributeName': 'pk',
-                  'KeyType': 'HASH',
-              },
-              {
-                  'AttributeName': 'sk',
-                  'KeyType': 'RANGE',
-              }
-          ],
-          ProvisionedThroughput={
-              'ReadCapacityUnits': 2,
-              'WriteCapacityUnits': 2,
-          },
-          GlobalSecondaryIndexes=[
-          {
-                'IndexName': INDEX_NAME_DT,
-                'KeySchema': [
-                    {
-                        'AttributeName': 'sk',
-                        'KeyType': 'HASH'
-                    },
-                    {
-                        'AttributeName': 'pk',
-                        'KeyType': 'RANGE'
-                    },
-                ],
-                'Projection': {
-                    'ProjectionType': 'ALL'
-                },
-                'ProvisionedThroughput': {
-                    'ReadCapacityUnits': 2,
-                    'WriteCapacityUnits': 2
-                }
-            },
-            {
-                'IndexName': INDEX_NAME_P,
-                'KeySchema': [
-                    {
-                      'AttributeName': 'sk',
-                      'KeyType': 'HASH'
-                    },
-                    {
-                      'AttributeName': 'price',
-                      'KeyType': 'RANGE'
-                    },
-                ],
-                'Projection': {
-                    'ProjectionType': 'ALL'
-                },
-                'ProvisionedThroughput': {
-                    'ReadCapacityUnits': 2,
-                    'WriteCapacityUnits': 2
-                }
-            },
-          ],
-          TableName=TABLE_NAME,
-        )
+        db_client = aws_clients.dynamodb_client()
+        db_client.create_table(**table_definition(billing_mode))
         return True
     except ClientError as e:
         logging.error(e)
         return False
 
+def table_definition(billing_mode=dynamodb_tables.PROVISIONED):
+    shard_attribute = dynamodb_sharding.SHARD_ATTRIBUTE if GSI_SHARDS else None
+    return dynamodb_tables.table_definition(TABLE_NAME, INDEX_NAME_DT, INDEX_NAME_P, billing_mode,
+                                            shard_attribute=shard_attribute)
+
+def ensure_table(billing_mode=dynamodb_tables.PROVISIONED):
+    # Create the table if missing and wait until it and its indexes are ACTIVE
+    return dynamodb_tables.ensure_table(table_definition(billing_mode))
+
+def build_item(pk,sk,vendor,title,desc,price):
+    item = {
+      'pk': {
+        'S': pk,
+      },
+      'sk': {
+        'S': sk,
+      },
+      'vendor': {
+        'S': vendor,
+      },
+      'title': {
+        'S': title,
+      },
+      'description': {
+        'S': desc,
+      },
+      'price': {
+        'N': str(price), #Note: Even though a number, it is passed as a string
+      },
+    }
+    if GSI_SHARDS:
+        dynamodb_sharding.add_shard_key(item, GSI_SHARDS)
+    return item
+
 def put_items(table_name, pk,sk,vendor,title,desc,price):
     try:
-      db_client = boto3.client('dynamodb')
+      db_client = aws_clients.dynamodb_client()
       db_client.put_item(
-        Item={
-          'pk': {
-            'S': pk,
-          },
-          'sk': {
-            'S': sk,
-          },
-          'vendor': {
-            'S': vendor,
-          },
-          'title': {
-            'S': title,
-          },
-          'description': {
-            'S': desc,
-          },
-          'price': {
-            'N': str(price), #Note: Even though a number, it is passed as a string
-          },
-        },
+        Item=build_item(pk,sk,vendor,title,desc,price),
         ReturnConsumedCapacity='TOTAL',
         TableName=TABLE_NAME,
       )        
@@ -121,39 +74,228 @@ def put_items(table_name, pk,sk,vendor,title,desc,price):
     except Exception as e:
         logging.error(e)
         return False
+
+def batch_put_items(table_name, records):
+    # Bulk load (pk, sk, vendor, title, desc, price) records with BatchWriteItem
+    items = (build_item(*record) for record in records)
+    return dynamodb_batch.batch_write(table_name, items)
 def get_item(table_name, partition_key, sort_key):
     # Get an item from the table
-    table = boto3.resource('dynamodb').Table(table_name)
+    table = aws_clients.get_resource('dynamodb').Table(table_name)
     item = table.get_item(Key={partition_key: partition_key, sort_key: sort_key})
     print(f"Item retrieved: {item.get('Item')}.")
 
 def delete_item(table_name, partition_key, sort_key):
     # Delete an item from the table
-    table = boto3.resource('dynamodb').Table(table_name)
+    table = aws_clients.get_resource('dynamodb').Table(table_name)
     table.delete_item(Key={partition_key: partition_key, sort_key: sort_key})
     print(f"Item with partition key '{partition_key}' and sort key '{sort_key}' deleted.")
 
-dynamodb.delete_table(TableName=TABLE_NAME)
-print(f"Table '{TABLE_NAME}' deleted.")
-
-def query_table(table_name, partition_key, sort_key_start, sort_key_end):
-    # Query the table for items within a range of the sort key
-    table = boto3.resource('dynamodb').Table(table_name)
-    response = table.query(
-        KeyConditionExpression=boto3.dynamodb.conditions.Key(partition_key).eq(partition_key) & 
-                               boto3.dynamodb.conditions.Key(sort_key_start).between(sort_key_start, sort_key_end)
-    )
-    print(f"Items retrieved: {response['Items']}.")
+def query_table(table_name, partition_key, sort_key_start, sort_key_end, page_size=None, prefetch=False,
+                splits=1):
+    # Query the table for items within a range of the sort key.
+    # Yields items lazily across all result pages instead of only the first 1 MB.
+    # splits > 1 cuts the sort key range into that many sub-ranges, queries them
+    # concurrently and merges the results back into sort key order.
+    if splits <= 1:
+        table = aws_clients.get_resource('dynamodb').Table(table_name)
+        yield from dynamodb_paging.items(
+            table.query,
+            page_size=page_size,
+            prefetch=prefetch,
+            KeyConditionExpression=Key('pk').eq(partition_key) &
+                                   Key('sk').between(sort_key_start, sort_key_end)
+        )
+        return
+
+    def table_query(**kwargs):
+        # Resources are per thread, so every worker gets its own Table.
+        return aws_clients.get_resource('dynamodb').Table(table_name).query(**kwargs)
+
+    bounds = dynamodb_paging.split_range(sort_key_start, sort_key_end, splits)
+    requests = [{'KeyConditionExpression': Key('pk').eq(partition_key) & Key('sk').between(low, high)}
+                for low, high in zip(bounds, bounds[1:])]
+    previous = None
+    for item in dynamodb_paging.merged_items(table_query, requests, lambda item: item['sk'],
+                                             page_size=page_size):
+        # Neighbouring sub-ranges both return the item on their shared bound.
+        if item != previous:
+            yield item
+        previous = item
 def delete_table():
 
     try:
-        db_client = boto3.client('dynamodb')
+        db_client = aws_clients.dynamodb_client()
         db_client.delete_table(TableName=TABLE_NAME)
         return True
     except ClientError as e:
         logging.error(e)
         return False
 
+###############################################################################
+# Batch command mode: run a script of commands in one process.
+# One command per line, quoted like a shell command, # starts a comment:
+#   create [PROVISIONED|PAY_PER_REQUEST]
+#   put <pk> <sk> <vendor> <title> <description> <price>
+#   get <pk> <sk>
+#   delete <pk> <sk>
+#   query <pk> <sk start> <sk end>
+# Runs of puts/deletes are sent as parallel BatchWriteItem chunks (the last
+# write to a key wins) and runs of gets as BatchGetItem calls. A command that
+# reads or changes the table first flushes whatever is queued before it, so
+# the results are the same as running the commands one by one.
+###############################################################################
+COMMAND_ARGS = {
+    'create': (0, 1),
+    'put': (6, 6),
+    'get': (2, 2),
+    'delete': (2, 2),
+    'query': (3, 3),
+}
+
+
+def parse_commands(lines):
+    for number, line in enumerate(lines, 1):
+        words = shlex.split(line, comments=True)
+        if not words:
+            continue
+        name, args = words[0].lower(), words[1:]
+        low, high = COMMAND_ARGS.get(name, (-1, -1))
+        if not low <= len(args) <= high:
+            raise ValueError(f'Line {number}: cannot parse {line.strip()!r}')
+        if name == 'put':
+            try:
+                args[5] = Decimal(args[5])
+            except InvalidOperation:
+                raise ValueError(f'Line {number}: bad price {args[5]!r}') from None
+        yield number, name, args
+
+
+def run_commands(lines, max_workers=dynamodb_batch.MAX_WORKERS):
+    commands = list(parse_commands(lines))
+    # kind -> [commands, calls, seconds]
+    timings = {}
+    writes = {}
+    write_count = 0
+    gets = []
+    failed = 0
+
+    def timed(kind, count, calls, start):
+        entry = timings.setdefault(kind, [0, 0, 0.0])
+        entry[0] += count
+        entry[1] += calls
+        entry[2] += time.monotonic() - start
+
+    def flush_writes():
+        nonlocal failed, write_count
+        if not writes:
+            return
+        start = time.monotonic()
+        requests = list(writes.values())
+        writes.clear()
+        size = dynamodb_batch.BATCH_WRITE_SIZE
+        futures = [pool.submit(dynamodb_batch.write_requests, TABLE_NAME,
+                               requests[i:i + size])
+                   for i in range(0, len(requests), size)]
+        for future in futures:
+            try:
+                future.result()
+            except (ClientError, RuntimeError) as e:
+                logging.error(e)
+                failed += 1
+        timed('put/delete', write_count, len(futures), start)
+        write_count = 0
+
+    def flush_gets():
+        nonlocal failed
+        if not gets:
+            return
+        start = time.monotonic()
+        keys = [{'pk': {'S': pk}, 'sk': {'S': sk}} for pk, sk in gets]
+        try:
+            items = dynamodb_batch.batch_get(TABLE_NAME, keys, max_workers=max_workers)
+            for (pk, sk), item in zip(gets, items):
+                print(f"get {pk} {sk}: {item}")
+        except (ClientError, RuntimeError) as e:
+            logging.error(e)
+            failed += 1
+        calls = -(-len(set(gets)) // dynamodb_batch.BATCH_GET_SIZE)
+        timed('get', len(gets), calls, start)
+        gets.clear()
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for number, name, args in commands:
+            if name == 'put' or name == 'delete':
+                flush_gets()
+                pk, sk = args[0], args[1]
+                if name == 'put':
+                    request = {'PutRequest': {'Item': build_item(*args)}}
+                else:
+                    request = {'DeleteRequest': {'Key': {'pk': {'S': pk}, 'sk': {'S': sk}}}}
+                writes.pop((pk, sk), None)
+                writes[(pk, sk)] = request
+                write_count += 1
+                continue
+            flush_writes()
+            if name == 'get':
+                gets.append((args[0], args[1]))
+                continue
+            flush_gets()
+            command_start = time.monotonic()
+            if name == 'create':
+                billing_mode = args[0].upper() if args else dynamodb_tables.PROVISIONED
+                try:
+                    created, differences = ensure_table(billing_mode)
+                    print(f"create: table {'created' if created else 'exists'}"
+                          + (f", differs: {differences}" if differences else ""))
+                except ClientError as e:
+                    logging.error(e)
+                    failed += 1
+                timed('create', 1, 1, command_start)
+            elif name == 'query':
+                pk, low, high = args
+                try:
+                    pages = list(dynamodb_paging.pages(
+                        aws_clients.dynamodb_client().query,
+                        TableName=TABLE_NAME,
+                        KeyConditionExpression='pk = :pk AND sk BETWEEN :low AND :high',
+                        ExpressionAttributeValues={
+                            ':pk': {'S': pk},
+                            ':low': {'S': low},
+                            ':high': {'S': high},
+                        },
+                    ))
+                    items = [item for page in pages for item in page.get('Items', [])]
+                    print(f"query {pk} {low}..{high}: {len(items)} items")
+                    for item in items:
+                        print(f"  {item}")
+                except ClientError as e:
+                    logging.error(e)
+                    failed += 1
+                    pages = [None]
+                timed('query', 1, len(pages), command_start)
+        flush_writes()
+        flush_gets()
+
+    seconds = time.monotonic() - start
+    print_timings(timings, len(commands), failed, seconds)
+    return {
+        'commands': len(commands),
+        'failed': failed,
+        'seconds': seconds,
+        'timings': timings,
+    }
+
+
+def print_timings(timings, commands, failed, seconds):
+    print(f"\n{'kind':<12}{'commands':>10}{'calls':>8}{'seconds':>10}")
+    for kind, (count, calls, kind_seconds) in timings.items():
+        print(f"{kind:<12}{count:>10}{calls:>8}{kind_seconds:>10.3f}")
+    rate = commands / seconds if seconds else 0.0
+    print(f"{commands} commands in {seconds:.3f} s ({rate:.0f} commands/s), "
+          f"{failed} failed batches")
+
 def menu():
     # Main menu for the program
     while True:
@@ -206,3 +348,23 @@ def menu():
             sort_key_start = input("Enter sort key start value: ")
       
 
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DogToys table tool.")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="run the commands in FILE (- for stdin) instead of the menu")
+    parser.add_argument("--workers", type=int, default=dynamodb_batch.MAX_WORKERS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    if args.batch is None:
+        menu()
+    elif args.batch == "-":
+        run_commands(sys.stdin, args.workers)
+    else:
+        with open(args.batch) as f:
+            run_commands(f, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import os
+import threading
+import boto3
+from botocore.config import Config
+###############################################################################
+# Shared AWS client registry.
+# boto3 clients are thread-safe once created, but building one reloads the
+# service model and opens a new connection pool. Clients are created once per
+# (service, region, endpoint) and handed out to every module in the process.
+###############################################################################
+REGION = os.environ.get('AWS_REGION')
+MAX_POOL_CONNECTIONS = 50
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+MAX_ATTEMPTS = 5
+RETRY_MODE = 'adaptive'
+
+# Default endpoint per service, None means the public AWS endpoint.
+# DynamoDb defaults to DynamoDB Local; set DYNAMODB_ENDPOINT or
+# configure(endpoints={'dynamodb': None}) to use AWS.
+ENDPOINTS = {
+    'dynamodb': os.environ.get('DYNAMODB_ENDPOINT', 'http://localhost:8000'),
+    's3': os.environ.get('S3_ENDPOINT'),
+}
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+_resources = threading.local()
+_generation = 0
+# service -> callables run on every new client, see add_client_hook().
+_client_hooks = {}
+###############################################################################
+# Change the shared settings. Cached clients are dropped so the next call
+# picks up the new values.
+###############################################################################
+def configure(region=None, max_pool_connections=None, connect_timeout=None,
+              read_timeout=None, max_attempts=None, retry_mode=None,
+              endpoints=None):
+    global REGION, MAX_POOL_CONNECTIONS, CONNECT_TIMEOUT, READ_TIMEOUT
+    global MAX_ATTEMPTS, RETRY_MODE, _generation
+    with _lock:
+        if region is not None:
+            REGION = region
+        if max_pool_connections is not None:
+            MAX_POOL_CONNECTIONS = max_pool_connections
+        if connect_timeout is not None:
+            CONNECT_TIMEOUT = connect_timeout
+        if read_timeout is not None:
+            READ_TIMEOUT = read_timeout
+        if max_attempts is not None:
+            MAX_ATTEMPTS = max_attempts
+        if retry_mode is not None:
+            RETRY_MODE = retry_mode
+        if endpoints:
+            ENDPOINTS.update(endpoints)
+        _clients.clear()
+        _generation += 1
+###############################################################################
+# Build the botocore Config from the current settings.
+###############################################################################
+def client_config(region=None):
+    return Config(
+        region_name=region or REGION,
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        retries={'max_attempts': MAX_ATTEMPTS, 'mode': RETRY_MODE},
+    )
+###############################################################################
+# Sessions are not thread-safe, so one is created under the lock and reused
+# only while holding it.
+###############################################################################
+def _get_session():
+    global _session
+    if _session is None:
+        _session = boto3.session.Session()
+    return _session
+
+
+def _endpoint_for(service, endpoint_url):
+    if endpoint_url is not None:
+        return endpoint_url
+    return ENDPOINTS.get(service)
+###############################################################################
+# Get the cached low-level client for a service.
+###############################################################################
+def get_client(service, endpoint_url=None, region=None):
+    endpoint_url = _endpoint_for(service, endpoint_url)
+    region = region or REGION
+    key = (service, region, endpoint_url)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _get_session().client(
+                service, endpoint_url=endpoint_url,
+                config=client_config(region))
+            for hook in _client_hooks.get(service, []):
+                hook(client)
+            _clients[key] = client
+    return client
+###############################################################################
+# Get the resource for a service. Resources are not thread-safe, so each
+# thread gets its own copy.
+###############################################################################
+def get_resource(service, endpoint_url=None):
+    endpoint_url = _endpoint_for(service, endpoint_url)
+    key = (service, REGION, endpoint_url, _generation)
+    cache = _resources.__dict__.setdefault('cache', {})
+    resource = cache.get(key)
+    if resource is None:
+        with _lock:
+            resource = _get_session().resource(
+                service, endpoint_url=endpoint_url, config=client_config())
+            for hook in _client_hooks.get(service, []):
+                hook(resource.meta.client)
+        cache[key] = resource
+    return resource
+###############################################################################
+# Run hook(client) on every client of a service, including ones already
+# created. Used to attach botocore event handlers such as instrumentation.
+###############################################################################
+def add_client_hook(service, hook):
+    global _generation
+    with _lock:
+        hooks = _client_hooks.setdefault(service, [])
+        if hook in hooks:
+            return
+        hooks.append(hook)
+        # Per-thread resources are rebuilt so they pick up the hook too.
+        _generation += 1
+        for (client_service, *_), client in _clients.items():
+            if client_service == service:
+                hook(client)
+
+
+def dynamodb_client(endpoint_url=None):
+    return get_client('dynamodb', endpoint_url)
+
+
+def s3_client(endpoint_url=None, region=None):
+    return get_client('s3', endpoint_url, region)
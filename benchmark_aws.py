@@ -0,0 +1,241 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import aws_clients
+import dynamodb_functions
+import dynamodb_tables
+import s3functions
+###############################################################################
+# Benchmark the DynamoDb and S3 helpers against local stand-ins.
+#
+#   --backend local  DynamoDB Local at aws_clients.ENDPOINTS and an
+#                    S3-compatible server (e.g. MinIO) at $S3_ENDPOINT.
+#   --backend moto   in-process mocks for both services (needs moto).
+#
+# Each operation is run for every item count / object size and concurrency
+# level; throughput and latency percentiles are printed and saved as JSON.
+# --compare old.json flags results that got slower than --threshold.
+#
+# Run with: python benchmark_aws.py --backend moto --out run.json
+###############################################################################
+ITEM_COUNTS = [100, 1000]
+OBJECT_SIZES = [1024, 1024 * 1024]
+CONCURRENCY = [1, 8]
+OBJECT_COUNT = 20
+THRESHOLD = 0.10
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+###############################################################################
+# Run fn once per argument tuple on a pool of `concurrency` threads and time
+# every call. Returns throughput and latency percentiles.
+###############################################################################
+def measure(fn, calls, concurrency):
+    latencies = []
+
+    def timed(args):
+        start = time.perf_counter()
+        fn(*args)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, calls))
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'ops': len(calls),
+        'seconds': seconds,
+        'ops_per_s': len(calls) / seconds if seconds else 0.0,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+    }
+###############################################################################
+# DynamoDb: put_item, get_item, query and scan on a fresh table per size.
+# The helpers are pointed at table_name for the run; it must not exist yet,
+# since it is deleted after every size.
+###############################################################################
+def bench_dynamodb(table_name, item_counts, concurrency_levels):
+    results = []
+    saved_table_name = dynamodb_functions.TABLE_NAME
+    dynamodb_functions.TABLE_NAME = table_name
+    try:
+        for count in item_counts:
+            for concurrency in concurrency_levels:
+                results += _bench_table(count, concurrency)
+    finally:
+        dynamodb_functions.TABLE_NAME = saved_table_name
+    return results
+
+
+def _bench_table(count, concurrency):
+    results = []
+    created, _ = dynamodb_functions.ensure_table(dynamodb_tables.PAY_PER_REQUEST)
+    if not created:
+        raise RuntimeError(f'Table {dynamodb_functions.TABLE_NAME} already exists')
+    records = [(f'dt{i}', 'guitar', 'Brand', f'Model {i}',
+                'A benchmark guitar.', i) for i in range(count)]
+    keys = [(pk, sk) for pk, sk, *_ in records]
+
+    def record(operation, stats):
+        stats.update(service='dynamodb', operation=operation,
+                     size=count, concurrency=concurrency)
+        results.append(stats)
+        print_result(stats)
+
+    try:
+        record('put_item', measure(dynamodb_functions.put_item, records, concurrency))
+        record('get_item', measure(dynamodb_functions.get_item, keys, concurrency))
+        passes = [()] * max(concurrency, 4)
+        record('query', measure(
+            lambda: list(dynamodb_functions.query('guitar', 0, count)),
+            passes, concurrency))
+        record('scan', measure(
+            lambda: list(dynamodb_functions.scan()), passes, concurrency))
+    finally:
+        dynamodb_functions.delete_table()
+        dynamodb_tables.wait_for_table_deleted(dynamodb_functions.TABLE_NAME,
+                                               dynamodb_functions.ENDPOINT)
+    return results
+###############################################################################
+# S3: upload_file, download_file and delete_all_objects per object size.
+###############################################################################
+def bench_s3(bucket, object_sizes, concurrency_levels, object_count):
+    results = []
+    aws_clients.s3_client().create_bucket(Bucket=bucket)
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in object_sizes:
+            source = os.path.join(work_dir, f'source-{size}')
+            with open(source, 'wb') as f:
+                f.write(os.urandom(size))
+            for concurrency in concurrency_levels:
+                keys = [f'bench/{size}/{i}' for i in range(object_count)]
+
+                def record(operation, stats):
+                    stats.update(service='s3', operation=operation,
+                                 size=size, concurrency=concurrency)
+                    stats['mb_per_s'] = stats['ops_per_s'] * size / 1e6
+                    results.append(stats)
+                    print_result(stats)
+
+                record('upload_file', measure(
+                    s3functions.upload_file,
+                    [(bucket, source, key) for key in keys], concurrency))
+                record('download_file', measure(
+                    s3functions.download_file,
+                    [(bucket, key, os.path.join(work_dir, f'down-{i}'))
+                     for i, key in enumerate(keys)], concurrency))
+                stats = measure(s3functions.delete_all_objects, [(bucket,)], 1)
+                # One call, but it removes object_count objects.
+                stats['ops'] = object_count
+                stats['ops_per_s'] = object_count / stats['seconds']
+                record('delete_all_objects', stats)
+    s3functions.delete_bucket(bucket)
+    return results
+###############################################################################
+# Reporting and regression checks.
+###############################################################################
+def print_result(stats):
+    print(f'{stats["service"]:<9}{stats["operation"]:<20}size {stats["size"]:>9} '
+          f'x{stats["concurrency"]:<3} {stats["ops_per_s"]:>10.1f} ops/s  '
+          f'p50 {stats["p50_ms"]:8.2f}  p95 {stats["p95_ms"]:8.2f}  '
+          f'p99 {stats["p99_ms"]:8.2f} ms')
+
+
+def result_key(stats):
+    return (stats['service'], stats['operation'], stats['size'], stats['concurrency'])
+
+
+def compare(baseline, current, threshold=THRESHOLD):
+    old = {result_key(r): r for r in baseline['results']}
+    regressions = []
+    for new in current['results']:
+        before = old.get(result_key(new))
+        if before is None:
+            continue
+        slower = before['ops_per_s'] and new['ops_per_s'] < before['ops_per_s'] * (1 - threshold)
+        later = before['p95_ms'] and new['p95_ms'] > before['p95_ms'] * (1 + threshold)
+        if slower or later:
+            regressions.append((result_key(new), before, new))
+            print(f'REGRESSION {result_key(new)}: '
+                  f'{before["ops_per_s"]:.1f} -> {new["ops_per_s"]:.1f} ops/s, '
+                  f'p95 {before["p95_ms"]:.2f} -> {new["p95_ms"]:.2f} ms')
+    if not regressions:
+        print('No regressions.')
+    return regressions
+###############################################################################
+# moto is optional; it is only needed for --backend moto.
+###############################################################################
+def start_moto():
+    try:
+        from moto import mock_aws
+    except ImportError:
+        raise SystemExit('--backend moto needs the moto package (pip install moto)')
+    for name, value in (('AWS_ACCESS_KEY_ID', 'testing'),
+                        ('AWS_SECRET_ACCESS_KEY', 'testing'),
+                        ('AWS_DEFAULT_REGION', 'us-east-1')):
+        os.environ.setdefault(name, value)
+    mock = mock_aws()
+    mock.start()
+    # moto intercepts the default AWS endpoints, not DynamoDB Local's.
+    aws_clients.configure(region='us-east-1', endpoints={'dynamodb': None, 's3': None})
+    return mock
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the DynamoDb and S3 helpers.')
+    parser.add_argument('--backend', choices=['local', 'moto'], default='local')
+    parser.add_argument('--services', nargs='+', choices=['dynamodb', 's3'],
+                        default=['dynamodb', 's3'])
+    parser.add_argument('--items', nargs='+', type=int, default=ITEM_COUNTS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=OBJECT_SIZES)
+    parser.add_argument('--concurrency', nargs='+', type=int, default=CONCURRENCY)
+    parser.add_argument('--objects', type=int, default=OBJECT_COUNT)
+    parser.add_argument('--table', default=f'benchmark-{uuid.uuid4()}')
+    parser.add_argument('--bucket', default=f'benchmark-{uuid.uuid4()}')
+    parser.add_argument('--out', help='save results to this JSON file')
+    parser.add_argument('--compare', help='earlier results JSON to check against')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    mock = start_moto() if args.backend == 'moto' else None
+    try:
+        results = []
+        if 'dynamodb' in args.services:
+            results += bench_dynamodb(args.table, args.items, args.concurrency)
+        if 's3' in args.services:
+            results += bench_s3(args.bucket, args.sizes, args.concurrency, args.objects)
+    finally:
+        if mock is not None:
+            mock.stop()
+
+    run = {
+        'time': time.time(),
+        'backend': args.backend,
+        'python': platform.python_version(),
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(run, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), run, args.threshold)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
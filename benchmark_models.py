@@ -0,0 +1,64 @@
+import time
+import tracemalloc
+from decimal import Decimal
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from dynamodb_models import Guitar
+###############################################################################
+# Compare dynamodb_models with boto3's TypeSerializer/TypeDeserializer.
+# Run with: python benchmark_models.py [item_count]
+###############################################################################
+ITEM_COUNT = 100000
+
+
+def make_items(count):
+    return [
+        Guitar(f'g{i}', 'guitar', 'Fender', f'Model {i % 50}',
+               'A solid body electric guitar.', Decimal(i % 2000) / 4).to_item()
+        for i in range(count)
+    ]
+
+
+def timed(label, fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{label:<34} {elapsed:8.3f} s  peak {peak / 1e6:8.1f} MB')
+    return result
+###############################################################################
+# Each contender turns the wire items into Python values and back.
+###############################################################################
+def boto3_deserialize(items):
+    deserializer = TypeDeserializer()
+    return [{k: deserializer.deserialize(v) for k, v in item.items()}
+            for item in items]
+
+
+def boto3_serialize(dicts):
+    serializer = TypeSerializer()
+    return [{k: serializer.serialize(v) for k, v in d.items()} for d in dicts]
+
+
+def records_deserialize(items, number=Decimal):
+    return Guitar.from_items(items, number)
+
+
+def records_serialize(records):
+    return [record.to_item() for record in records]
+
+
+def main(count=ITEM_COUNT):
+    items = make_items(count)
+    print(f'{count} Guitar items')
+    dicts = timed('boto3 TypeDeserializer', boto3_deserialize, items)
+    timed('Guitar.from_items (Decimal)', records_deserialize, items)
+    records = timed('Guitar.from_items (float)', records_deserialize, items, float)
+    timed('boto3 TypeSerializer', boto3_serialize, dicts)
+    timed('Guitar.to_item', records_serialize, records)
+
+
+if __name__ == '__main__':
+    import sys
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ITEM_COUNT)
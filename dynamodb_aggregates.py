@@ -0,0 +1,212 @@
+import logging
+from decimal import Decimal
+import aws_clients
+import dynamodb_batch
+import dynamodb_paging
+import dynamodb_sharding
+import dynamodb_tables
+import dynamodb_update
+from botocore.exceptions import ClientError
+###############################################################################
+# Materialized per-category price aggregates.
+# Every sk category has one aggregate item, keyed on the category, holding
+# the item count, the price total, and the lowest and highest price. A
+# dashboard reads it with one GetItem instead of querying every item in the
+# category. Aggregates live in their own table (aggregate_table()), so scans,
+# exports, indexes and skew reports of the data table never see them.
+#
+# Writers call apply_change(old_item, new_item) after each single-item
+# write, passing the item from before the write (ReturnValues='ALL_OLD') and
+# the one after it:
+#   count and total  atomic ADD, so concurrent writers never lose an update
+#   min and max      conditional SET that only ever lowers min / raises max
+# When the lowest or highest priced item goes away, the next one is read
+# from the price index and stored, but only if the bound has not changed in
+# between. Batch writes do not return old items, so bulk loaders read them
+# with BatchGetItem first. rebuild() recomputes every aggregate from a
+# parallel scan.
+###############################################################################
+AGGREGATE_TABLE_SUFFIX = '-aggregates'
+SCAN_SEGMENTS = 4
+
+
+def aggregate_table(table_name):
+    return table_name + AGGREGATE_TABLE_SUFFIX
+
+
+def aggregate_key(category):
+    return {'category': {'S': category}}
+###############################################################################
+# Create the aggregate table of table_name if it is missing.
+###############################################################################
+def ensure_table(table_name, endpoint_url=None):
+    definition = {
+        'TableName': aggregate_table(table_name),
+        'AttributeDefinitions': [{'AttributeName': 'category', 'AttributeType': 'S'}],
+        'KeySchema': [{'AttributeName': 'category', 'KeyType': 'HASH'}],
+        'BillingMode': dynamodb_tables.PAY_PER_REQUEST,
+    }
+    return dynamodb_tables.ensure_table(definition, endpoint_url)
+###############################################################################
+# (category, price) an item contributes, None if it contributes nothing.
+###############################################################################
+def contribution(item):
+    if not item or 'price' not in item:
+        return None
+    return item['sk']['S'], Decimal(item['price']['N'])
+###############################################################################
+# Record one item write. old_item / new_item are attribute-value items or
+# None (for a new item / a delete).
+###############################################################################
+def apply_change(table_name, old_item, new_item, price_index_name,
+                 endpoint_url=None, shards=0):
+    old, new = contribution(old_item), contribution(new_item)
+    if old == new:
+        return
+    db_client = aws_clients.dynamodb_client(endpoint_url)
+    if old is not None:
+        _remove(db_client, table_name, old_item['pk']['S'], *old,
+                price_index_name, shards)
+    if new is not None:
+        _add(db_client, aggregate_table(table_name), *new)
+
+
+def _add(db_client, aggregates_name, category, price):
+    key = aggregate_key(category)
+    dynamodb_update.update_item(aggregates_name, key, add={'count': 1, 'total': price},
+                                must_exist=False, operation=db_client.update_item)
+    for attribute, compare in (('min', '>'), ('max', '<')):
+        _set_bound(db_client, aggregates_name, key, attribute, price,
+                   f'attribute_not_exists(#b) OR #b {compare} :price')
+
+
+def _remove(db_client, table_name, pk, category, price, price_index_name, shards):
+    key = aggregate_key(category)
+    aggregates_name = aggregate_table(table_name)
+    current = dynamodb_update.update_item(
+        aggregates_name, key, add={'count': -1, 'total': -price}, must_exist=False,
+        operation=db_client.update_item, return_values='ALL_NEW')
+    for attribute, ascending in (('min', True), ('max', False)):
+        if attribute not in current or Decimal(current[attribute]['N']) != price:
+            continue
+        # The bound item is gone; find the next one, skipping pk in case the
+        # index has not caught up with this write yet.
+        bound = _next_bound(db_client, table_name, price_index_name, category,
+                            pk, ascending, shards)
+        _set_bound(db_client, aggregates_name, key, attribute, bound, '#b = :old',
+                   old=price)
+
+
+def _set_bound(db_client, table_name, key, attribute, price, condition, old=None):
+    request = {
+        'TableName': table_name,
+        'Key': key,
+        'ConditionExpression': condition,
+        'ExpressionAttributeNames': {'#b': attribute},
+        'ExpressionAttributeValues': {},
+    }
+    if price is None:
+        request['UpdateExpression'] = 'REMOVE #b'
+    else:
+        request['UpdateExpression'] = 'SET #b = :price'
+        request['ExpressionAttributeValues'][':price'] = {'N': str(price)}
+    if old is not None:
+        request['ExpressionAttributeValues'][':old'] = {'N': str(old)}
+    try:
+        db_client.update_item(**request)
+    except ClientError as e:
+        # Another writer already moved the bound past this price.
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+
+def _next_bound(db_client, table_name, price_index_name, category, skip_pk,
+                ascending, shards):
+    request = {
+        'TableName': table_name,
+        'IndexName': price_index_name,
+        'ProjectionExpression': 'pk, price',
+        'ScanIndexForward': ascending,
+    }
+    if shards:
+        request['KeyConditionExpression'] = (
+            f'{dynamodb_sharding.SHARD_ATTRIBUTE} = {dynamodb_sharding.SHARD_PLACEHOLDER}')
+        items = dynamodb_sharding.scatter_query(db_client.query, request, category,
+                                                shards, 'price', page_size=10)
+    else:
+        request['KeyConditionExpression'] = 'sk = :sk'
+        request['ExpressionAttributeValues'] = {':sk': {'S': category}}
+        items = dynamodb_paging.items(db_client.query, 10, **request)
+    try:
+        for item in items:
+            if item['pk']['S'] != skip_pk:
+                return Decimal(item['price']['N'])
+        return None
+    finally:
+        items.close()
+###############################################################################
+# Read one category's aggregate with a single GetItem.
+# Returns count, total, min, max and average, or None if there is none.
+###############################################################################
+def aggregate_values(item):
+    count = int(item.get('count', {}).get('N', '0'))
+    total = Decimal(item.get('total', {}).get('N', '0'))
+    return {
+        'category': item['category']['S'],
+        'count': count,
+        'total': total,
+        'min': Decimal(item['min']['N']) if 'min' in item else None,
+        'max': Decimal(item['max']['N']) if 'max' in item else None,
+        'average': total / count if count > 0 else None,
+    }
+
+
+def get_aggregate(table_name, category, endpoint_url=None, consistent_read=False):
+    db_client = aws_clients.dynamodb_client(endpoint_url)
+    item = db_client.get_item(TableName=aggregate_table(table_name),
+                              Key=aggregate_key(category),
+                              ConsistentRead=consistent_read).get('Item')
+    return aggregate_values(item) if item else None
+###############################################################################
+# Recompute every aggregate from a parallel scan of the whole table and
+# replace the stored ones, creating the aggregate table if needed. Writes
+# that land during the scan may be missed; run it when the table is quiet,
+# or again afterwards.
+###############################################################################
+def rebuild(table_name, endpoint_url=None, segments=SCAN_SEGMENTS):
+    ensure_table(table_name, endpoint_url)
+    aggregates_name = aggregate_table(table_name)
+    db_client = aws_clients.dynamodb_client(endpoint_url)
+    stale = {item['category']['S'] for item in dynamodb_paging.items(
+        db_client.scan, ProjectionExpression='category', TableName=aggregates_name)}
+    items = dynamodb_paging.parallel_items(
+        db_client.scan, segments,
+        ProjectionExpression='pk, sk, price',
+        TableName=table_name,
+    )
+    totals = {}
+    for item in items:
+        found = contribution(item)
+        if found is None:
+            continue
+        category, price = found
+        count, total, low, high = totals.get(category, (0, Decimal(0), price, price))
+        totals[category] = (count + 1, total + price, min(low, price), max(high, price))
+
+    aggregates = {}
+    for category, (count, total, low, high) in totals.items():
+        item = aggregate_key(category)
+        item.update({
+            'count': {'N': str(count)},
+            'total': {'N': str(total)},
+            'min': {'N': str(low)},
+            'max': {'N': str(high)},
+        })
+        aggregates[category] = item
+    if not dynamodb_batch.batch_write(aggregates_name, aggregates.values(), endpoint_url,
+                                      key_attributes=('category',)):
+        raise RuntimeError(f'Writing the aggregates of {table_name} failed')
+    for category in stale - set(totals):
+        db_client.delete_item(TableName=aggregates_name, Key=aggregate_key(category))
+    logging.info(f'Rebuilt {len(aggregates)} aggregates of {table_name}')
+    return {category: aggregate_values(item) for category, item in aggregates.items()}
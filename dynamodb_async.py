@@ -0,0 +1,179 @@
+import asyncio
+import functools
+import heapq
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import aws_clients
+import dynamodb_functions
+import dynamodb_sharding
+import dynamodb_tables
+from botocore.exceptions import ClientError
+###############################################################################
+# asyncio interface to the DynamoDb helpers.
+# Calls run on a private thread pool against the shared registry client, so
+# the event loop never blocks and every request shares one connection pool.
+# A semaphore caps how many calls are in flight; any number of coroutines can
+# wait on it, e.g. thousands of get_item calls fanned out with asyncio.gather.
+#
+# timeout (seconds) applies to each call and raises asyncio.TimeoutError.
+# Cancelling a coroutine returns control right away; the HTTP request that
+# was already sent finishes in the background and its result is dropped.
+#
+# Tables follow dynamodb_functions.GSI_SHARDS like the sync helpers do:
+# create_table keys the GSIs on the shard attribute, and query reads every
+# shard and merges them in price order.
+###############################################################################
+class AsyncDynamoDB:
+
+    def __init__(self, table_name=dynamodb_functions.TABLE_NAME,
+                 endpoint_url=dynamodb_functions.ENDPOINT,
+                 max_concurrency=None, timeout=None):
+        self.table_name = table_name
+        self.endpoint_url = endpoint_url
+        self.max_concurrency = max_concurrency or aws_clients.MAX_POOL_CONNECTIONS
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _call(self, operation, **kwargs):
+        db_client = aws_clients.dynamodb_client(self.endpoint_url)
+        call = functools.partial(getattr(db_client, operation), **kwargs)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await asyncio.wait_for(
+                loop.run_in_executor(self._pool, call), self.timeout)
+    ###########################################################################
+    # Table operations.
+    ###########################################################################
+    async def create_table(self, billing_mode=dynamodb_tables.PROVISIONED):
+        try:
+            definition = dynamodb_functions.table_definition(billing_mode)
+            definition['TableName'] = self.table_name
+            await self._call('create_table', **definition)
+            return True
+        except ClientError as e:
+            logging.error(e)
+            return False
+
+    async def delete_table(self):
+        try:
+            await self._call('delete_table', TableName=self.table_name)
+            return True
+        except ClientError as e:
+            logging.error(e)
+            return False
+    ###########################################################################
+    # Item operations.
+    ###########################################################################
+    async def put_item(self, pk, sk, brand, model, desc, price):
+        try:
+            await self._call(
+                'put_item',
+                Item=dynamodb_functions.build_item(pk, sk, brand, model, desc, price),
+                ReturnConsumedCapacity='TOTAL',
+                TableName=self.table_name,
+            )
+            return True
+        except ClientError as e:
+            logging.error(e)
+            return False
+
+    async def get_item(self, pk, sk):
+        try:
+            response = await self._call(
+                'get_item',
+                Key={'pk': {'S': pk}, 'sk': {'S': sk}},
+                TableName=self.table_name,
+            )
+            return response.get('Item')
+        except ClientError as e:
+            logging.error(e)
+            return None
+    ###########################################################################
+    # Query and scan yield items page by page as an async iterator.
+    ###########################################################################
+    async def _items(self, operation, page_size=None, **kwargs):
+        if page_size:
+            kwargs['Limit'] = page_size
+        while True:
+            response = await self._call(operation, **kwargs)
+            for item in response.get('Items', []):
+                yield item
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    async def _merged(self, iterators, sort_key):
+        # heapq.merge for async iterators; each one must already be sorted.
+        async def following(iterator):
+            try:
+                return await iterator.__anext__()
+            except StopAsyncIteration:
+                return None
+
+        try:
+            firsts = await asyncio.gather(*(following(it) for it in iterators))
+            heap = [(sort_key(item), n, item)
+                    for n, item in enumerate(firsts) if item is not None]
+            heapq.heapify(heap)
+            while heap:
+                _, n, item = heap[0]
+                yield item
+                item = await following(iterators[n])
+                if item is None:
+                    heapq.heappop(heap)
+                else:
+                    heapq.heapreplace(heap, (sort_key(item), n, item))
+        finally:
+            for iterator in iterators:
+                await iterator.aclose()
+
+    def query(self, sk, low_price, high_price, page_size=None,
+              index_name=dynamodb_functions.INDEX_NAME_P):
+        shards = dynamodb_functions.GSI_SHARDS
+        values = {
+            ':v2': {'N': str(low_price)},
+            ':v3': {'N': str(high_price)},
+        }
+        if not shards:
+            return self._items(
+                'query',
+                page_size=page_size,
+                ExpressionAttributeValues=dict(values, **{':v1': {'S': sk}}),
+                KeyConditionExpression='sk = :v1 AND price BETWEEN :v2 AND :v3',
+                TableName=self.table_name,
+                IndexName=index_name,
+            )
+        placeholder = dynamodb_sharding.SHARD_PLACEHOLDER
+        iterators = [
+            self._items(
+                'query',
+                page_size=page_size,
+                ExpressionAttributeValues=dict(values, **{placeholder: {'S': key}}),
+                KeyConditionExpression=(f'{dynamodb_sharding.SHARD_ATTRIBUTE} = '
+                                        f'{placeholder} AND price BETWEEN :v2 AND :v3'),
+                TableName=self.table_name,
+                IndexName=index_name,
+            )
+            for key in dynamodb_sharding.shard_keys(sk, shards)
+        ]
+        return self._merged(iterators, dynamodb_sharding.sort_value('price'))
+
+    def scan(self, page_size=None, **kwargs):
+        return self._items('scan', page_size=page_size,
+                           TableName=self.table_name, **kwargs)
+    ###########################################################################
+    # Run many coroutines at once; the semaphore still limits real requests.
+    ###########################################################################
+    async def gather(self, coroutines, return_exceptions=False):
+        return await asyncio.gather(*coroutines,
+                                    return_exceptions=return_exceptions)
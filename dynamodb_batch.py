@@ -0,0 +1,202 @@
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import aws_clients
+import dynamodb_throttle
+from botocore.exceptions import ClientError
+###############################################################################
+# Batch DynamoDb reads and writes.
+# https://docs.aws.amazon.com/amazondynamodb/latest/APIReference/API_BatchWriteItem.html
+# https://docs.aws.amazon.com/amazondynamodb/latest/APIReference/API_BatchGetItem.html
+###############################################################################
+BATCH_WRITE_SIZE = 25
+BATCH_GET_SIZE = 100
+MAX_WORKERS = 8
+MAX_RETRIES = 10
+BASE_DELAY = 0.05
+MAX_DELAY = 5.0
+KEY_ATTRIBUTES = ('pk', 'sk')
+###############################################################################
+# Full jitter backoff: a random delay up to an exponentially growing cap.
+###############################################################################
+def backoff_delay(attempt):
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * (2 ** attempt)))
+
+
+def item_key(item, key_attributes=KEY_ATTRIBUTES):
+    return tuple(tuple(item[name].items())[0] for name in key_attributes)
+###############################################################################
+# Split items into BatchWriteItem sized chunks.
+# A single request may not hold the same key twice, so a later put for a key
+# already in the current chunk replaces the earlier one. Repeats across
+# chunks are ordered by InFlightKeys.
+###############################################################################
+def write_chunks(items, key_attributes=KEY_ATTRIBUTES, size=BATCH_WRITE_SIZE):
+    chunk = {}
+    for item in items:
+        chunk[item_key(item, key_attributes)] = item
+        if len(chunk) == size:
+            yield list(chunk.values())
+            chunk = {}
+    if chunk:
+        yield list(chunk.values())
+###############################################################################
+# Keys of the chunks still being written, for loaders that write chunks in
+# parallel. A chunk that shares a key with an earlier chunk must wait for it
+# (conflicts()), so the later put lands last, as with serial put_item calls,
+# and a writer that reads old items first sees the earlier write.
+###############################################################################
+class InFlightKeys:
+
+    def __init__(self, key_attributes=KEY_ATTRIBUTES):
+        self.key_attributes = key_attributes
+        self._futures = {}
+        self._keys = {}
+
+    def conflicts(self, items):
+        keys = (item_key(item, self.key_attributes) for item in items)
+        return {self._futures[key] for key in keys if key in self._futures}
+
+    def add(self, future, items):
+        keys = [item_key(item, self.key_attributes) for item in items]
+        self._keys[future] = keys
+        for key in keys:
+            self._futures[key] = future
+
+    def discard(self, future):
+        for key in self._keys.pop(future, ()):
+            if self._futures.get(key) is future:
+                del self._futures[key]
+###############################################################################
+# Send up to 25 PutRequest/DeleteRequest entries, re-sending UnprocessedItems
+# until they are all accepted. Returns the number of requests written.
+###############################################################################
+def write_requests(table_name, requests, endpoint_url=None, limiter=None):
+    db_client = aws_clients.dynamodb_client(endpoint_url)
+    batch_write_item = db_client.batch_write_item
+    if limiter is not None:
+        batch_write_item = limiter.wrap(dynamodb_throttle.WRITE, batch_write_item)
+    count = len(requests)
+    attempt = 0
+    while requests:
+        response = batch_write_item(
+            RequestItems={table_name: requests},
+            ReturnConsumedCapacity='TOTAL',
+        )
+        requests = response.get('UnprocessedItems', {}).get(table_name, [])
+        if not requests:
+            break
+        if limiter is not None:
+            limiter.throttled(dynamodb_throttle.WRITE)
+        if attempt >= MAX_RETRIES:
+            raise RuntimeError(
+                f'{len(requests)} items still unprocessed after '
+                f'{MAX_RETRIES} retries')
+        time.sleep(backoff_delay(attempt))
+        attempt += 1
+    return count
+###############################################################################
+# Write one chunk of items. Returns the number of items written.
+###############################################################################
+def write_chunk(table_name, items, endpoint_url=None, limiter=None):
+    requests = [{'PutRequest': {'Item': item}} for item in items]
+    return write_requests(table_name, requests, endpoint_url, limiter)
+###############################################################################
+# Bulk put a stream of items into a table.
+# Chunks are written on a worker pool; at most 2 * max_workers chunks are held
+# in memory at once so a generator of any size can be loaded.
+# limiter is an optional dynamodb_throttle.CapacityLimiter.
+# write replaces write_chunk, with the same arguments.
+# Returns True if every item was written.
+###############################################################################
+def batch_write(table_name, items, endpoint_url=None, max_workers=MAX_WORKERS,
+                key_attributes=KEY_ATTRIBUTES, limiter=None, write=None):
+    write = write or write_chunk
+    ok = True
+    written = 0
+    pending = set()
+    in_flight = InFlightKeys(key_attributes)
+
+    def collect(done):
+        nonlocal ok, written
+        for future in done:
+            in_flight.discard(future)
+            try:
+                written += future.result()
+            except (ClientError, RuntimeError) as e:
+                logging.error(e)
+                ok = False
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for chunk in write_chunks(items, key_attributes):
+            conflicts = in_flight.conflicts(chunk)
+            if conflicts:
+                wait(conflicts)
+                pending -= conflicts
+                collect(conflicts)
+            if len(pending) >= max_workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            future = pool.submit(write, table_name, chunk, endpoint_url, limiter)
+            in_flight.add(future, chunk)
+            pending.add(future)
+        done, pending = wait(pending)
+        collect(done)
+    logging.info(f'Wrote {written} items to {table_name}.')
+    return ok
+###############################################################################
+# Read one chunk of keys, re-sending UnprocessedKeys until all are answered.
+# Returns the items found, in no particular order.
+###############################################################################
+def get_chunk(table_name, keys, endpoint_url=None, consistent_read=False,
+              limiter=None):
+    db_client = aws_clients.dynamodb_client(endpoint_url)
+    batch_get_item = db_client.batch_get_item
+    if limiter is not None:
+        batch_get_item = limiter.wrap(dynamodb_throttle.READ, batch_get_item)
+    request = {'Keys': keys, 'ConsistentRead': consistent_read}
+    items = []
+    attempt = 0
+    while request:
+        response = batch_get_item(
+            RequestItems={table_name: request},
+            ReturnConsumedCapacity='TOTAL',
+        )
+        items.extend(response.get('Responses', {}).get(table_name, []))
+        request = response.get('UnprocessedKeys', {}).get(table_name)
+        if not request:
+            break
+        if limiter is not None:
+            limiter.throttled(dynamodb_throttle.READ)
+        if attempt >= MAX_RETRIES:
+            raise RuntimeError(
+                f'{len(request["Keys"])} keys still unprocessed after '
+                f'{MAX_RETRIES} retries')
+        time.sleep(backoff_delay(attempt))
+        attempt += 1
+    return items
+###############################################################################
+# Fetch many keys at once.
+# Duplicate keys are requested once, chunks of 100 keys run on a worker pool,
+# and the result list lines up with the keys passed in (None if not found).
+###############################################################################
+def batch_get(table_name, keys, endpoint_url=None, max_workers=MAX_WORKERS,
+              key_attributes=KEY_ATTRIBUTES, consistent_read=False,
+              limiter=None):
+    keys = list(keys)
+    unique = {}
+    for key in keys:
+        unique.setdefault(item_key(key, key_attributes), key)
+    unique_keys = list(unique.values())
+    chunks = [unique_keys[i:i + BATCH_GET_SIZE]
+              for i in range(0, len(unique_keys), BATCH_GET_SIZE)]
+
+    found = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(get_chunk, table_name, chunk, endpoint_url,
+                               consistent_read, limiter) for chunk in chunks]
+        for future in futures:
+            for item in future.result():
+                found[item_key(item, key_attributes)] = item
+    return [found.get(item_key(key, key_attributes)) for key in keys]
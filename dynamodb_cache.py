@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+###############################################################################
+# In-process read-through cache for DynamoDb items.
+# Least recently used entries are dropped once max_size is reached, and an
+# entry older than ttl seconds is treated as a miss.
+#
+# A read-through fill must not overwrite a newer put or an invalidate that
+# landed while the read was in flight. Readers take generation() before
+# reading and fill() afterwards; fill() is skipped if the key changed since.
+# The last change of up to max_size keys is remembered; keys forgotten
+# earlier are treated as changed at the newest forgotten generation.
+###############################################################################
+class ItemCache:
+
+    def __init__(self, max_size=1024, ttl=60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._generation = 0
+        # key -> generation of its last put/invalidate, oldest first.
+        self._changed = OrderedDict()
+        self._forgotten = 0
+        self._lock = threading.Lock()
+
+    def _change(self, key):
+        self._generation += 1
+        self._changed[key] = self._generation
+        self._changed.move_to_end(key)
+        while len(self._changed) > self.max_size:
+            _, self._forgotten = self._changed.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, item = entry
+            if expires < time.monotonic():
+                del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def fill(self, key, item, generation):
+        with self._lock:
+            if self._changed.get(key, self._forgotten) > generation:
+                return False
+            self._store(key, item)
+            return True
+
+    def put(self, key, item):
+        with self._lock:
+            self._change(key)
+            self._store(key, item)
+
+    def _store(self, key, item):
+        self._items[key] = (time.monotonic() + self.ttl, item)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._change(key)
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._changed.clear()
+            self._forgotten = self._generation
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._items),
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
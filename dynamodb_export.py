@@ -0,0 +1,141 @@
+import base64
+import gzip
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import aws_clients
+import dynamodb_paging
+import s3functions
+###############################################################################
+# Stream a whole table to sharded JSONL files, optionally gzip compressed.
+# Items are written in DynamoDb JSON (the attribute-value format), so numbers,
+# sets and binary values survive the round trip; B and BS values are base64
+# encoded, as in DynamoDb's own JSON exports. Memory use stays flat: items
+# go straight from the scan to the open shard file.
+#
+# With a bucket, every finished shard is uploaded through
+# s3functions.upload_file on a background pool while the scan carries on
+# with the next shard.
+###############################################################################
+SHARD_ITEMS = 100000
+UPLOAD_WORKERS = 4
+
+
+def shard_name(table_name, number, compress):
+    return f'{table_name}-{number:05d}.jsonl' + ('.gz' if compress else '')
+
+
+def _open_shard(path, compress):
+    if compress:
+        return gzip.open(path, 'wt', encoding='utf-8', compresslevel=6)
+    return open(path, 'w', encoding='utf-8')
+
+
+def _binary(value):
+    # json.dumps hook for B / BS values, at any depth.
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode('ascii')
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _upload(bucket, path, object_name, keep_local):
+    if not s3functions.upload_file(bucket, path, object_name):
+        raise RuntimeError(f'Upload of {path} to s3://{bucket}/{object_name} failed')
+    if not keep_local:
+        os.remove(path)
+    return object_name
+###############################################################################
+# Export table_name into out_dir.
+# segments > 1 scans with that many parallel workers. Returns a summary with
+# the item count, the shard files and, when uploading, the S3 keys.
+###############################################################################
+def export_table(table_name, out_dir, endpoint_url=None, segments=1,
+                 shard_items=SHARD_ITEMS, compress=True, bucket=None,
+                 prefix='', keep_local=True, page_size=None):
+    os.makedirs(out_dir, exist_ok=True)
+    db_client = aws_clients.dynamodb_client(endpoint_url)
+    if segments > 1:
+        items = dynamodb_paging.parallel_items(db_client.scan, segments,
+                                               page_size, TableName=table_name)
+    else:
+        items = dynamodb_paging.items(db_client.scan, page_size,
+                                      TableName=table_name)
+
+    start = time.monotonic()
+    shards = []
+    uploads = []
+    total = 0
+    shard = None
+    shard_count = 0
+    upload_pool = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) if bucket else None
+
+    def finish_shard():
+        nonlocal shard
+        shard.close()
+        path = shards[-1]['path']
+        if upload_pool is not None:
+            object_name = prefix + os.path.basename(path)
+            shards[-1]['key'] = object_name
+            uploads.append(upload_pool.submit(_upload, bucket, path,
+                                              object_name, keep_local))
+        shard = None
+
+    try:
+        for item in items:
+            if shard is None:
+                path = os.path.join(out_dir, shard_name(table_name, len(shards), compress))
+                shard = _open_shard(path, compress)
+                shards.append({'path': path, 'items': 0})
+                shard_count = 0
+            shard.write(json.dumps(item, separators=(',', ':'), default=_binary))
+            shard.write('\n')
+            shard_count += 1
+            shards[-1]['items'] = shard_count
+            total += 1
+            if shard_count >= shard_items:
+                finish_shard()
+        if shard is not None:
+            finish_shard()
+        for future in uploads:
+            future.result()
+    finally:
+        if shard is not None:
+            shard.close()
+        if upload_pool is not None:
+            upload_pool.shutdown(wait=True)
+
+    seconds = time.monotonic() - start
+    manifest = {
+        'table': table_name,
+        'items': total,
+        'seconds': seconds,
+        'shards': shards,
+    }
+    with open(os.path.join(out_dir, f'{table_name}-manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    logging.info(f'Exported {total} items from {table_name} into '
+                 f'{len(shards)} shards in {seconds:.1f} s')
+    return manifest
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Export a DynamoDb table to JSONL shards.')
+    parser.add_argument('table')
+    parser.add_argument('out_dir')
+    parser.add_argument('--endpoint')
+    parser.add_argument('--segments', type=int, default=1)
+    parser.add_argument('--shard-items', type=int, default=SHARD_ITEMS)
+    parser.add_argument('--no-compress', action='store_true')
+    parser.add_argument('--bucket', help='upload each shard to this S3 bucket')
+    parser.add_argument('--prefix', default='')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    export_table(args.table, args.out_dir, args.endpoint, args.segments,
+                 args.shard_items, not args.no_compress, args.bucket, args.prefix)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,105 +1,76 @@
 import logging
-import time
-import boto3
+from decimal import Decimal
+import aws_clients
+import dynamodb_aggregates
+import dynamodb_batch
+import dynamodb_cache
+import dynamodb_import
+import dynamodb_models
+import dynamodb_offload
+import dynamodb_paging
+import dynamodb_planner
+import dynamodb_sharding
+import dynamodb_tables
+import dynamodb_throttle
+import dynamodb_update
+import dynamodb_writebehind
 from botocore.exceptions import ClientError
-ENDPOINT = 'http://localhost:8000'
+# None uses aws_clients.ENDPOINTS['dynamodb']; set the endpoint there.
+ENDPOINT = None
 
 
 TABLE_NAME = 'Guitar'
 INDEX_NAME_DT = 'GuitarBrandidIndex'
 INDEX_NAME_P = 'PriceIdIndex'
+# Shards per category on the GSIs; 0 keeps them keyed on plain sk.
+# Must match how the table was created, see dynamodb_sharding.
+GSI_SHARDS = 0
 
+# Optional read-through cache in front of get_item, see enable_cache().
+item_cache = None
+# Optional capacity-aware rate limiter, see enable_rate_limiter().
+rate_limiter = None
+# Optional write-behind buffer for put_item/delete_item, see enable_write_behind().
+write_buffer = None
+# Keep per-category price aggregates up to date, see enable_aggregates().
+aggregates = False
+# (bucket, prefix, threshold) for offloading large attributes, see enable_offload().
+offload = None
 
 # Create a DynamoDb Table.
+# billing_mode=dynamodb_tables.PAY_PER_REQUEST creates an on-demand table.
 ###############################################################################
-def create_table():
+def create_table(billing_mode=dynamodb_tables.PROVISIONED):
 
     try:
-        db_client = boto3.client('dynamodb', endpoint_url=ENDPOINT)
-        db_client.create_table(
-          AttributeDefinitions=[
-             {
-                  'AttributeName': 'pk',
-                  'AttributeType': 'S',
-              },
-              {
-                  'AttributeName': 'sk',
-                  'AttributeType': 'S',
-              },
-              {
-                  'AttributeName': 'price',
-                  'AttributeType': 'N',
-              }
-          ],
-          KeySchema=[
-              {
-                  'AttributeName': 'pk',
-                  'KeyType': 'HASH',
-              },
-              {
-                  'AttributeName': 'sk',
-                  'KeyType': 'RANGE',
-              }
-          ],
-          ProvisionedThroughput={
-              'ReadCapacityUnits': 2,
-              'WriteCapacityUnits': 2,
-          },
-          GlobalSecondaryIndexes=[
-          {
-                'IndexName': INDEX_NAME_DT,
-                'KeySchema': [
-                    {
-                        'AttributeName': 'sk',
-                        'KeyType': 'HASH'
-                    },
-                    {
-                        'AttributeName': 'pk',
-                        'KeyType': 'RANGE'
-                    },
-                ],
-                'Projection': {
-                    'ProjectionType': 'ALL'
-                },
-                'ProvisionedThroughput': {
-                    'ReadCapacityUnits': 2,
-                    'WriteCapacityUnits': 2
-                }
-            },
-            {
-                'IndexName': INDEX_NAME_P,
-                'KeySchema': [
-                    {
-                      'AttributeName': 'sk',
-                      'KeyType': 'HASH'
-                    },
-                    {
-                      'AttributeName': 'price',
-                      'KeyType': 'RANGE'
-                    },
-                ],
-                'Projection': {
-                    'ProjectionType': 'ALL'
-                },
-                'ProvisionedThroughput': {
-                    'ReadCapacityUnits': 2,
-                    'WriteCapacityUnits': 2
-                }
-            },
-          ],
-          TableName=TABLE_NAME,
-        )
+        db_client = aws_clients.dynamodb_client(ENDPOINT)
+        db_client.create_table(**table_definition(billing_mode))
         return True
     except ClientError as e:
         logging.error(e)
         return False
 ###############################################################################
+# Table definition shared by create_table and ensure_table.
+###############################################################################
+def table_definition(billing_mode=dynamodb_tables.PROVISIONED):
+
+    return dynamodb_tables.table_definition(
+      TABLE_NAME, INDEX_NAME_DT, INDEX_NAME_P, billing_mode,
+      shard_attribute=dynamodb_sharding.SHARD_ATTRIBUTE if GSI_SHARDS else None)
+###############################################################################
+# Create the table only if it does not exist yet and wait until it and its
+# indexes are ACTIVE. Returns (created, differences from the definition).
+###############################################################################
+def ensure_table(billing_mode=dynamodb_tables.PROVISIONED):
+
+    return dynamodb_tables.ensure_table(table_definition(billing_mode), ENDPOINT)
+###############################################################################
 # Describe a DynamoDb Table.
 ###############################################################################
 def describe_table():
 
     try:
-        db_client = boto3.client('dynamodb')
+        db_client = aws_clients.dynamodb_client(ENDPOINT)
         response = db_client.describe_table(TableName=TABLE_NAME)
         return response['Table']['TableStatus']
     except ClientError as e:
@@ -111,55 +82,101 @@ def describe_table():
 def delete_table():
 
     try:
-        db_client = boto3.client('dynamodb')
+        db_client = aws_clients.dynamodb_client(ENDPOINT)
         db_client.delete_table(TableName=TABLE_NAME)
         return True
     except ClientError as e:
         logging.error(e)
         return False
 ###############################################################################
+# Build a DynamoDb Item.
+###############################################################################
+def build_item(pk,sk,brand,model,desc,price):
+
+    item = {
+      'pk': {
+        'S': pk,
+      },
+      'sk': {
+        'S': sk,
+      },
+      'brand': {
+        'S': brand,
+      },
+      'model': {
+        'S': model,
+      },
+      'description': {
+        'S': desc,
+      },
+      'price': {
+        'N': str(price), 
+      },
+    }
+    if GSI_SHARDS:
+      dynamodb_sharding.add_shard_key(item, GSI_SHARDS)
+    return item
+###############################################################################
 # Put a DynamoDb Item.
 ###############################################################################
 def put_item(pk,sk,brand,model,desc,price):
 
     try:
-      db_client = boto3.client('dynamodb')
-      db_client.put_item(
-        Item={
-          'pk': {
-            'S': pk,
-          },
-          'sk': {
-            'S': sk,
-          },
-          'brand': {
-            'S': brand,
-          },
-          'model': {
-            'S': model,
-          },
-          'description': {
-            'S': desc,
-          },
-          'price': {
-            'N': str(price), 
-          },
-        },
-        ReturnConsumedCapacity='TOTAL',
-        TableName=TABLE_NAME,
-      )        
+      db_client = aws_clients.dynamodb_client(ENDPOINT)
+      item = build_item(pk,sk,brand,model,desc,price)
+      stored = offload_item(item)
+      if write_buffer is not None:
+        write_buffer.put(stored)
+      else:
+        response = limited(dynamodb_throttle.WRITE, db_client.put_item)(
+          Item=stored,
+          ReturnConsumedCapacity='TOTAL',
+          ReturnValues='ALL_OLD' if aggregates or offload else 'NONE',
+          TableName=TABLE_NAME,
+        )        
+        track_write(response.get('Attributes'), item, stored)
+      if item_cache is not None:
+        item_cache.put((pk, sk), item)
       return True
     except Exception as e:
+        if item_cache is not None:
+          item_cache.invalidate((pk, sk))
         logging.error(e)
         return False
 ###############################################################################
+# Put many DynamoDb Items with BatchWriteItem.
+# Each record is a (pk, sk, brand, model, desc, price) tuple; any iterable
+# works, including a generator.
+###############################################################################
+def put_items(records, max_workers=dynamodb_batch.MAX_WORKERS):
+
+    flush_writes()
+    items = (offload_item(build_item(*record)) for record in records)
+    result = dynamodb_batch.batch_write(TABLE_NAME, items, ENDPOINT, max_workers,
+                                        limiter=rate_limiter, write=chunk_writer())
+    if item_cache is not None:
+      item_cache.clear()
+    return result
+###############################################################################
 # Get a DynamoDb Item.
 ###############################################################################
 def get_item(pk,sk):
 
+    if write_buffer is not None:
+      item = write_buffer.get({'pk': {'S': pk}, 'sk': {'S': sk}})
+      if item is dynamodb_writebehind.DELETED:
+        return None
+      if item is not None:
+        return dynamodb_offload.lazy(item)
+    if item_cache is not None:
+      item = item_cache.get((pk, sk))
+      if item is not None:
+        return item
     try:
-      db_client = boto3.client('dynamodb')
-      response = db_client.get_item(
+      # A put or delete that lands while this read is in flight wins.
+      generation = item_cache.generation() if item_cache is not None else None
+      db_client = aws_clients.dynamodb_client(ENDPOINT)
+      response = limited(dynamodb_throttle.READ, db_client.get_item)(
         Key={
           'pk': {
             'S': pk,
@@ -170,28 +187,378 @@ def get_item(pk,sk):
         },
         TableName=TABLE_NAME,
       )
-      return response["Item"]
+      item = dynamodb_offload.lazy(response.get('Item'))
+      if item_cache is not None and item is not None:
+        item_cache.fill((pk, sk), item, generation)
+      return item
     except ClientError as e:
         logging.error(e)
         return None
 ###############################################################################
+# Get a DynamoDb Item as a dynamodb_models.Guitar record.
+###############################################################################
+def get_guitar(pk,sk):
+
+    item = get_item(pk,sk)
+    if item is None:
+      return None
+    return dynamodb_models.Guitar.from_item(item)
+###############################################################################
+# Delete a DynamoDb Item.
+###############################################################################
+def delete_item(pk,sk):
+
+    try:
+      key = {
+        'pk': {
+          'S': pk,
+        },
+        'sk': {
+            'S': sk,
+        },
+      }
+      if write_buffer is not None:
+        write_buffer.delete(key)
+        return True
+      db_client = aws_clients.dynamodb_client(ENDPOINT)
+      response = limited(dynamodb_throttle.WRITE, db_client.delete_item)(
+        Key=key,
+        ReturnConsumedCapacity='TOTAL',
+        ReturnValues='ALL_OLD' if aggregates or offload else 'NONE',
+        TableName=TABLE_NAME,
+      )
+      track_write(response.get('Attributes'), None)
+      return True
+    except ClientError as e:
+        logging.error(e)
+        return False
+    finally:
+      if item_cache is not None:
+        item_cache.invalidate((pk, sk))
+###############################################################################
+# Turn the get_item cache on or off.
+# put_item and delete_item in this process keep it up to date; writes from
+# other processes show up once the entry's ttl runs out.
+###############################################################################
+def enable_cache(max_size=1024, ttl=60.0):
+
+    global item_cache
+    item_cache = dynamodb_cache.ItemCache(max_size, ttl)
+    return item_cache
+
+
+def disable_cache():
+
+    global item_cache
+    item_cache = None
+
+
+def cache_stats():
+
+    if item_cache is None:
+      return None
+    return item_cache.stats()
+###############################################################################
+# Turn the capacity-aware rate limiter on or off.
+# The starting rates come from the table's provisioned throughput and adapt
+# to the consumed capacity and throttling seen on each call.
+###############################################################################
+def enable_rate_limiter():
+
+    global rate_limiter
+    rate_limiter = dynamodb_throttle.CapacityLimiter.for_table(TABLE_NAME, ENDPOINT)
+    return rate_limiter
+
+
+def disable_rate_limiter():
+
+    global rate_limiter
+    rate_limiter = None
+
+
+def limited(kind, operation):
+
+    if rate_limiter is None:
+      return operation
+    return rate_limiter.wrap(kind, operation)
+###############################################################################
+# Turn the write-behind buffer on or off.
+# put_item and delete_item calls to the same key within `window` seconds are
+# merged and written together as BatchWriteItem chunks. get_item sees
+# buffered writes right away; the other reads flush the buffer first.
+# Writes the buffer gives up on are dropped from the item cache too.
+###############################################################################
+def enable_write_behind(window=dynamodb_writebehind.WINDOW,
+                        max_items=dynamodb_writebehind.MAX_ITEMS):
+
+    global write_buffer
+    if aggregates:
+      raise ValueError('Write-behind cannot be used while aggregates are on')
+    disable_write_behind()
+    write_buffer = dynamodb_writebehind.WriteBehindBuffer(
+      TABLE_NAME, ENDPOINT, window, max_items, limiter=rate_limiter,
+      on_drop=forget_writes)
+    return write_buffer
+
+
+def forget_writes(keys):
+
+    if item_cache is not None:
+      for (_, pk), (_, sk) in keys:
+        item_cache.invalidate((pk, sk))
+
+
+def disable_write_behind():
+
+    global write_buffer
+    if write_buffer is not None:
+      buffer, write_buffer = write_buffer, None
+      buffer.close()
+
+
+def flush_writes():
+
+    if write_buffer is None:
+      return True
+    try:
+      write_buffer.flush()
+      return True
+    except (ClientError, RuntimeError) as e:
+        logging.error(e)
+        return False
+###############################################################################
+# Turn the per-category price aggregates on or off.
+# While on, put_item, update_item and delete_item keep an aggregate item per
+# sk category up to date (count, min, max, average price) in the separate
+# dynamodb_aggregates.aggregate_table(TABLE_NAME) table. put_items and
+# import_file read the old items of each chunk with BatchGetItem first so
+# they can do the same. Enabling rebuilds them from a scan first; after that
+# rebuild_aggregates() is only needed to repair drift, and only while the
+# table is quiet.
+###############################################################################
+def enable_aggregates(segments=dynamodb_aggregates.SCAN_SEGMENTS):
+
+    global aggregates
+    if write_buffer is not None:
+      raise ValueError('Aggregates cannot be used while write-behind is on')
+    aggregates = True
+    return rebuild_aggregates(segments)
+
+
+def disable_aggregates():
+
+    global aggregates
+    aggregates = False
+
+
+def update_aggregates(old_item, new_item):
+
+    dynamodb_aggregates.apply_change(TABLE_NAME, old_item, new_item, INDEX_NAME_P,
+                                     ENDPOINT, GSI_SHARDS)
+
+
+###############################################################################
+# Bring aggregates and offloaded objects in line with a write that already
+# succeeded. A failure here is logged; it does not make the write fail.
+###############################################################################
+def track_write(old_item, new_item, stored=None):
+
+    try:
+      if aggregates:
+        update_aggregates(old_item, new_item)
+      if offload:
+        dynamodb_offload.delete_objects(old_item, keep=stored or new_item)
+    except (ClientError, RuntimeError) as e:
+        logging.error(e)
+###############################################################################
+# Chunk writer for the bulk loaders. With aggregates or offload on it reads
+# the old items of the chunk before writing, then tracks each write.
+###############################################################################
+def chunk_writer():
+
+    if not aggregates and not offload:
+      return dynamodb_batch.write_chunk
+
+    def write_tracked_chunk(table_name, items, endpoint_url=None, limiter=None):
+      keys = [{'pk': item['pk'], 'sk': item['sk']} for item in items]
+      old_items = {dynamodb_batch.item_key(old): old for old in
+                   dynamodb_batch.get_chunk(table_name, keys, endpoint_url, True, limiter)}
+      written = dynamodb_batch.write_chunk(table_name, items, endpoint_url, limiter)
+      for item in items:
+        track_write(old_items.get(dynamodb_batch.item_key(item)), item)
+      return written
+    return write_tracked_chunk
+
+
+def rebuild_aggregates(segments=dynamodb_aggregates.SCAN_SEGMENTS):
+
+    try:
+      return dynamodb_aggregates.rebuild(TABLE_NAME, ENDPOINT, segments)
+    except (ClientError, RuntimeError) as e:
+        logging.error(e)
+        return None
+###############################################################################
+# Get the count, total, min, max and average price of a category with one
+# GetItem, None if it has no aggregate.
+###############################################################################
+def get_aggregate(sk):
+
+    try:
+      return dynamodb_aggregates.get_aggregate(TABLE_NAME, sk, ENDPOINT)
+    except ClientError as e:
+        logging.error(e)
+        return None
+###############################################################################
+# Turn offloading of large attributes to S3 on or off.
+# While on, attributes over `threshold` bytes written by put_item, put_items
+# and update_item go to bucket under prefix, and the item only keeps a
+# pointer. get_item, get_items and find return items that download an
+# offloaded attribute the first time it is looked up.
+# Objects replaced by a buffered write are left in S3.
+###############################################################################
+def enable_offload(bucket, prefix=TABLE_NAME + '/', threshold=dynamodb_offload.THRESHOLD):
+
+    global offload
+    offload = (bucket, prefix, threshold)
+
+
+def disable_offload():
+
+    global offload
+    offload = None
+
+
+def offload_item(item):
+
+    if offload is None:
+      return item
+    bucket, prefix, threshold = offload
+    return dynamodb_offload.offload_item(item, bucket, prefix, threshold)
+###############################################################################
+# Update only some attributes of a DynamoDb Item.
+# e.g. update_item('dt1', 'DogTreat', set={'price': .99}) or
+# update_item('dt1', 'DogTreat', add={'stock': -1}, expected={'price': .99}).
+# Returns the new values of the changed attributes, None if the update failed
+# (including a failed condition or a missing item).
+###############################################################################
+def update_item(pk,sk,set=None,add=None,remove=None,expected=None):
+
+    try:
+      flush_writes()
+      key = {'pk': {'S': pk}, 'sk': {'S': sk}}
+      if offload and set:
+        # Run the new values through offload_item so big ones become pointers.
+        values = offload_item(dict(key, **{name: dynamodb_models.serialize(value)
+                                           for name, value in set.items()}))
+        set = {name: dynamodb_models.deserialize(values[name]) for name in set}
+      operation = limited(dynamodb_throttle.WRITE,
+                          aws_clients.dynamodb_client(ENDPOINT).update_item)
+      if not aggregates or not any('price' in (part or ()) for part in (set, add, remove)):
+        if offload and (set or remove):
+          return update_offloaded(key, set, add, remove, expected, operation)
+        return dynamodb_update.update_item(TABLE_NAME, key, set, add, remove, expected,
+                                           operation=operation)
+      # The aggregates need the old price too: read it, then only update if it
+      # is still the same, and try again if another writer got in between.
+      for attempt in range(dynamodb_batch.MAX_RETRIES):
+        old_item = aws_clients.dynamodb_client(ENDPOINT).get_item(
+          TableName=TABLE_NAME, Key=key, ConsistentRead=True).get('Item')
+        guard = dict(expected or {})
+        if old_item is not None and 'price' in old_item:
+          guard.setdefault('price', dynamodb_models.deserialize(old_item['price']))
+        try:
+          result = dynamodb_update.update_item(
+            TABLE_NAME, key, set, add, remove, guard, operation=operation,
+            return_values='ALL_NEW')
+        except ClientError as e:
+          if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+          current = aws_clients.dynamodb_client(ENDPOINT).get_item(
+            TableName=TABLE_NAME, Key=key, ConsistentRead=True).get('Item')
+          if old_item is None or current is None or \
+             current.get('price') == old_item.get('price'):
+            raise
+          continue
+        track_write(old_item, result)
+        changed = {name for part in (set, add) for name in (part or ())}
+        return {name: value for name, value in result.items() if name in changed}
+      raise RuntimeError(f'Price of {pk}/{sk} kept changing, update gave up')
+    except (ClientError, RuntimeError, dynamodb_offload.OffloadError) as e:
+        logging.error(e)
+        return None
+    finally:
+      if item_cache is not None:
+        item_cache.invalidate((pk, sk))
+###############################################################################
+# update_item with offload on. UPDATED_OLD returns the values the update
+# replaced or removed, so the S3 objects they point to can be deleted. The
+# new values are rebuilt from set and add, as UPDATED_NEW would return them.
+###############################################################################
+def update_offloaded(key, set, add, remove, expected, operation):
+
+    old = dynamodb_update.update_item(TABLE_NAME, key, set, add, remove, expected,
+                                      operation=operation, return_values='UPDATED_OLD')
+    new = {name: dynamodb_models.serialize(value) for name, value in (set or {}).items()}
+    for name, delta in (add or {}).items():
+      base = dynamodb_models.deserialize(old[name]) if name in old else Decimal(0)
+      new[name] = dynamodb_models.serialize(base + Decimal(str(delta)))
+    dynamodb_offload.delete_objects(old, keep=new)
+    return new
+###############################################################################
+# Bulk import a CSV or JSONL catalog of Guitar rows, resuming from the last
+# checkpoint if an earlier import of the same file was interrupted.
+###############################################################################
+def import_file(path, file_format=None, max_workers=dynamodb_batch.MAX_WORKERS):
+
+    summary = dynamodb_import.import_file(path, TABLE_NAME, dynamodb_models.Guitar,
+                                          file_format, ENDPOINT, max_workers,
+                                          limiter=rate_limiter, shards=GSI_SHARDS,
+                                          transform=offload_item,
+                                          write=chunk_writer())
+    if item_cache is not None:
+      item_cache.clear()
+    return summary
+###############################################################################
+# Get many DynamoDb Items with BatchGetItem.
+# keys is a list of (pk, sk) pairs; the result has one entry per pair, in the
+# same order, with None where no item exists.
+###############################################################################
+def get_items(keys, max_workers=dynamodb_batch.MAX_WORKERS):
+
+    try:
+      flush_writes()
+      key_items = [{'pk': {'S': pk}, 'sk': {'S': sk}} for pk, sk in keys]
+      items = dynamodb_batch.batch_get(TABLE_NAME, key_items, ENDPOINT, max_workers,
+                                       limiter=rate_limiter)
+      return [dynamodb_offload.lazy(item) for item in items]
+    except (ClientError, RuntimeError) as e:
+        logging.error(e)
+        return None
+###############################################################################
 # Query a DynamoDb table.
+# Lazily yields every matching item, following LastEvaluatedKey from page to
+# page. page_size sets Limit per request; prefetch reads the next page in the
+# background while the caller works on the current one.
+# With GSI_SHARDS every shard is queried in parallel and the items are merged
+# back into price order.
 # https://docs.aws.amazon.com/amazondynamodb/latest/APIReference/API_Query.html#DDB-Query-request-KeyConditionExpression
 ###############################################################################
-def query():
+def query(sk='guitar', low_price=1, high_price=2, page_size=None, prefetch=False):
 
     try:
-      db_client = boto3.client('dynamodb')
-      response = db_client.query(
+      flush_writes()
+      db_client = aws_clients.dynamodb_client(ENDPOINT)
+      operation = limited(dynamodb_throttle.READ, db_client.query)
+      request = dict(
           ExpressionAttributeValues={
               ':v1': {
-                  'S': 'guitar',
+                  'S': sk,
               },
               ':v2': {
-                  'N': '1',
+                  'N': str(low_price),
               },
               ':v3': {
-                  'N': '2',
+                  'N': str(high_price),
               }
           },
           #KeyConditionExpression='sk = :v2 AND pk = :v1',
@@ -201,20 +568,31 @@ def query():
           TableName = TABLE_NAME,
           IndexName = INDEX_NAME_P
       )
-      return response["Items"]
+      if GSI_SHARDS:
+        del request['ExpressionAttributeValues'][':v1']
+        request['KeyConditionExpression'] = (
+          f'{dynamodb_sharding.SHARD_ATTRIBUTE} = {dynamodb_sharding.SHARD_PLACEHOLDER}'
+          ' AND price BETWEEN :v2 AND :v3')
+        yield from dynamodb_sharding.scatter_query(operation, request, sk, GSI_SHARDS,
+                                                   'price', page_size)
+      else:
+        yield from dynamodb_paging.items(operation, page_size, prefetch, **request)
     except Exception as e:
         logging.error(e)
-        return None  
 ###############################################################################
-# Query a DynamoDb table.
+# Scan a DynamoDb table.
+# Lazily yields every matching item. With segments > 1 the table is read by
+# that many parallel Segment workers and their items are merged as they come
+# in; progress(segment, items_so_far, finished) reports on each segment.
 # https://docs.aws.amazon.com/amazondynamodb/latest/APIReference/API_Query.html#DDB-Query-request-KeyConditionExpression
 # https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/Expressions.OperatorsAndFunctions.html
 ###############################################################################
-def scan():
+def scan(segments=1, page_size=None, progress=None):
 
     try:
-      db_client = boto3.client('dynamodb')
-      response = db_client.scan(
+      flush_writes()
+      db_client = aws_clients.dynamodb_client(ENDPOINT)
+      request = dict(
           ExpressionAttributeNames={
               '#p': 'price',
               '#b': 'brand',
@@ -234,36 +612,60 @@ def scan():
           #FilterExpression='pk = :v1',
           FilterExpression='begins_with(pk,:v1)',
           #FilterExpression='#p BETWEEN :v2 AND :v3',
-          ProjectionExpression='#p, #v, #t',
+          ProjectionExpression='#p, #b, #m',
           TableName=TABLE_NAME,
       )
-      return response['Items']
+      if segments > 1:
+        yield from dynamodb_paging.parallel_items(
+            limited(dynamodb_throttle.READ, db_client.scan), segments,
+            page_size=page_size, progress=progress, **request)
+      else:
+        yield from dynamodb_paging.items(
+            limited(dynamodb_throttle.READ, db_client.scan), page_size=page_size, **request)
     except ClientError as e:
         logging.error(e)
-        return None   
+###############################################################################
+# Plan a lookup by pk, sk and/or price without running it.
+# Each condition is a value (equality) or a tuple such as ('between', 1, 10),
+# see dynamodb_planner. plan.description says which access path was chosen.
+###############################################################################
+def plan_query(pk=None, sk=None, price=None, projection=None):
+
+    return dynamodb_planner.plan(TABLE_NAME, INDEX_NAME_DT, INDEX_NAME_P,
+                                 pk=pk, sk=sk, price=price, projection=projection,
+                                 shards=GSI_SHARDS)
+###############################################################################
+# Find items by pk, sk and/or price using the cheapest access path: GetItem,
+# a Query on the table or one of its indexes, and a Scan only when nothing
+# else can serve the predicate.
+###############################################################################
+def find(pk=None, sk=None, price=None, projection=None, page_size=None, segments=1):
+
+    try:
+      flush_writes()
+      plan = plan_query(pk, sk, price, projection)
+      yield from dynamodb_offload.lazy_items(
+        dynamodb_planner.execute(plan, ENDPOINT, page_size, segments))
+    except (ClientError, dynamodb_offload.OffloadError) as e:
+        logging.error(e)
 ###############################################################################
 # Exercise the DynamoDb functions.
 ###############################################################################
 def main():
 
   create_table()
-
-  while True:
-    results = describe_table()
-    if results == 'ACTIVE':
-      break
-    time.sleep(10)
+  dynamodb_tables.wait_for_table(TABLE_NAME, ENDPOINT)
 
   #Add 3 items...
   put_item('dt1',"DogTreat","Chewy Treats Inc.","Super Chewy - Plain","A super yummy, plain flavored treat!",9.99)
   put_item('dt2',"DogTreat","Chewy Treats Inc.","Super Chewy - Mint","A super yummy, mint flavored treat!",1.59)
   put_item('dt3',"DogTreat","Chewy Treats Inc.","Super Chewy - Juicy Fruit","A super yummy, juicy fruit flavored treat!",2.19)
 
-  # Fix mistake on first item (overwrite the price)...
-  put_item('dt1',"DogTreat","Chewy Treats Inc.","Super Chewy - Plain","A super yummy, plain flavored treat!",.99)
-  item = get_item('dt1',"DogTreat") 
+  # Fix mistake on first item (update only the price)...
+  update_item('dt1',"DogTreat",set={'price': .99})
+  item = get_guitar('dt1',"DogTreat") 
   print('Item:', item)
-  print(item['vendor']['S'])
+  print(item.brand)
 
   # Add 3 more items...
   put_item('toy1',"small","DogToys R Us Inc.","Rubber Ball","A small rubber ball!",4.99)
@@ -278,5 +680,6 @@ def main():
 ###############################################################################
 # Exercise the DynamoDb functions.
 ###############################################################################
-main()
+if __name__ == '__main__':
+  main()
 
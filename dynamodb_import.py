@@ -0,0 +1,207 @@
+import csv
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+import dynamodb_batch
+import dynamodb_models
+import dynamodb_sharding
+###############################################################################
+# Resumable bulk import of CSV or JSONL catalog files.
+# Rows are streamed from the file, converted to items with a
+# dynamodb_models record type and written with parallel BatchWriteItem
+# chunks. A checkpoint (byte offset + item count) is saved as chunks finish,
+# so an import that dies can resume where it stopped instead of starting over.
+#
+# The checkpoint only ever moves past chunks that are written and every chunk
+# before them, so resuming may rewrite a few rows but never skips one.
+###############################################################################
+CHECKPOINT_INTERVAL = 5.0
+REPORT_INTERVAL = 10.0
+###############################################################################
+# Read lines in binary so file.tell() gives exact byte offsets.
+# end[0] is the offset just past the last line read; only that one is kept.
+###############################################################################
+def _lines(f, end):
+    while True:
+        line = f.readline()
+        if not line:
+            return
+        end[0] = f.tell()
+        yield line.decode('utf-8')
+###############################################################################
+# Yield (row, end_offset) for every row after start_offset.
+# CSV files need a header line; it is read again on resume.
+###############################################################################
+def read_rows(path, file_format=None, start_offset=0):
+    file_format = file_format or os.path.splitext(path)[1].lstrip('.').lower()
+    with open(path, 'rb') as f:
+        end = [start_offset]
+        if file_format == 'csv':
+            header = next(csv.reader(_lines(f, end)))
+            f.seek(max(start_offset, end[0]))
+            for values in csv.reader(_lines(f, end)):
+                if values:
+                    yield dict(zip(header, values)), end[0]
+        elif file_format in ('jsonl', 'ndjson', 'json'):
+            f.seek(start_offset)
+            for line in _lines(f, end):
+                if line.strip():
+                    yield json.loads(line), end[0]
+        else:
+            raise ValueError(f'Unsupported file format: {file_format}')
+###############################################################################
+# Row -> DynamoDb item through a record type; unknown columns are ignored.
+###############################################################################
+def row_to_item(row, record_type):
+    fields = {name: row.get(name) for name, _ in record_type.FIELDS}
+    return record_type(**fields).to_item()
+###############################################################################
+# Checkpoint file helpers. Writes go through a temporary file so a crash
+# while saving never leaves a corrupt checkpoint.
+###############################################################################
+def load_checkpoint(checkpoint_path):
+    try:
+        with open(checkpoint_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(checkpoint_path, offset, items):
+    tmp_path = f'{checkpoint_path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'offset': offset, 'items': items}, f)
+    os.replace(tmp_path, checkpoint_path)
+###############################################################################
+# Group items into deduplicated 25-item chunks, remembering the file offset
+# just past the last row of each chunk.
+###############################################################################
+def _chunks(rows, record_type, shards=0, transform=None):
+    chunk = {}
+    end_offset = 0
+    for row, end_offset in rows:
+        item = row_to_item(row, record_type)
+        if shards:
+            dynamodb_sharding.add_shard_key(item, shards)
+        if transform is not None:
+            item = transform(item)
+        chunk[dynamodb_batch.item_key(item)] = item
+        if len(chunk) == dynamodb_batch.BATCH_WRITE_SIZE:
+            yield list(chunk.values()), end_offset
+            chunk = {}
+    if chunk:
+        yield list(chunk.values()), end_offset
+###############################################################################
+# Import a file into a table.
+# Returns a summary with rows read, items written, seconds and rows/s;
+# 'completed' is False if a write failed (the checkpoint is kept for resume).
+# shards > 0 adds the sharded index key (see dynamodb_sharding).
+# transform, if given, is applied to every item before it is written.
+# write replaces dynamodb_batch.write_chunk, with the same arguments.
+###############################################################################
+def import_file(path, table_name, record_type=dynamodb_models.Guitar,
+                file_format=None, endpoint_url=None,
+                max_workers=dynamodb_batch.MAX_WORKERS, checkpoint_path=None,
+                resume=True, limiter=None, shards=0, transform=None, write=None):
+    write = write or dynamodb_batch.write_chunk
+    checkpoint_path = checkpoint_path or f'{path}.checkpoint'
+    checkpoint = load_checkpoint(checkpoint_path) if resume else None
+    offset = checkpoint['offset'] if checkpoint else 0
+    items_done = checkpoint['items'] if checkpoint else 0
+    if checkpoint:
+        logging.info(f'Resuming {path} at byte {offset} ({items_done} items done)')
+
+    start = time.monotonic()
+    last_save = last_report = start
+    written_now = 0
+    completed = True
+    # (future, end_offset, item_count) in file order.
+    in_flight = deque()
+    # A chunk repeating a key of an unfinished chunk waits for it.
+    in_flight_keys = dynamodb_batch.InFlightKeys()
+
+    def retire(block):
+        # Move the checkpoint past every finished chunk at the front.
+        nonlocal offset, items_done, written_now
+        while in_flight and (block or in_flight[0][0].done()):
+            future, end_offset, count = in_flight[0]
+            future.result()
+            in_flight.popleft()
+            in_flight_keys.discard(future)
+            offset = end_offset
+            items_done += count
+            written_now += count
+            block = False
+
+    rows = read_rows(path, file_format, offset)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        try:
+            for chunk, end_offset in _chunks(rows, record_type, shards, transform):
+                retire(len(in_flight) >= max_workers * 2)
+                wait(in_flight_keys.conflicts(chunk))
+                future = pool.submit(write, table_name, chunk, endpoint_url, limiter)
+                in_flight_keys.add(future, chunk)
+                in_flight.append((future, end_offset, len(chunk)))
+                now = time.monotonic()
+                if now - last_save >= CHECKPOINT_INTERVAL:
+                    save_checkpoint(checkpoint_path, offset, items_done)
+                    last_save = now
+                if now - last_report >= REPORT_INTERVAL:
+                    logging.info(f'{items_done} items imported, '
+                                 f'{written_now / (now - start):.0f} rows/s')
+                    last_report = now
+            while in_flight:
+                retire(True)
+        except Exception as e:
+            logging.error(e)
+            completed = False
+            for future, _, _ in in_flight:
+                future.cancel()
+            # Keep whatever finished before the failure.
+            try:
+                retire(False)
+            except Exception:
+                pass
+
+    if completed:
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+    else:
+        save_checkpoint(checkpoint_path, offset, items_done)
+
+    seconds = time.monotonic() - start
+    summary = {
+        'completed': completed,
+        'items': items_done,
+        'items_this_run': written_now,
+        'seconds': seconds,
+        'rows_per_second': written_now / seconds if seconds else 0.0,
+    }
+    logging.info(f'Imported {path} into {table_name}: {summary}')
+    return summary
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Bulk import a CSV/JSONL file.')
+    parser.add_argument('path')
+    parser.add_argument('table', choices=['Guitar', 'DogToys'])
+    parser.add_argument('--format', choices=['csv', 'jsonl'])
+    parser.add_argument('--endpoint')
+    parser.add_argument('--workers', type=int, default=dynamodb_batch.MAX_WORKERS)
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore any saved checkpoint')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    record_type = dynamodb_models.Guitar if args.table == 'Guitar' else dynamodb_models.DogToy
+    summary = import_file(args.path, args.table, record_type, args.format,
+                          args.endpoint, args.workers, resume=not args.restart)
+    print(f'{summary["items_this_run"]} items in {summary["seconds"]:.1f} s '
+          f'({summary["rows_per_second"]:.0f} rows/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+import json
+import math
+import os
+import threading
+import time
+import aws_clients
+import dynamodb_throttle
+###############################################################################
+# Per-operation cost and latency metrics for every DynamoDb call.
+# enable() attaches botocore event handlers to the shared clients, so every
+# call made through aws_clients is measured without touching call sites.
+# Calls are grouped by (operation, table, index), e.g.
+# ('Query', 'Guitar', 'PriceIdIndex'), and each group records a latency
+# histogram, consumed RCU/WCU, items returned, response bytes and throttles.
+# See:https://botocore.amazonaws.com/v1/documentation/api/latest/topics/events.html
+###############################################################################
+# Operations that accept ReturnConsumedCapacity.
+CAPACITY_OPERATIONS = (
+    'GetItem', 'PutItem', 'UpdateItem', 'DeleteItem', 'Query', 'Scan',
+    'BatchGetItem', 'BatchWriteItem', 'TransactGetItems', 'TransactWriteItems',
+)
+WRITE_OPERATIONS = (
+    'PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem',
+    'TransactWriteItems',
+)
+###############################################################################
+# Log-scale latency histogram: constant memory, about 5% percentile error.
+###############################################################################
+class LatencyHistogram:
+
+    FIRST_BUCKET_MS = 0.1
+    GROWTH = 1.1
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms):
+        index = 0
+        if ms > self.FIRST_BUCKET_MS:
+            index = math.ceil(math.log(ms / self.FIRST_BUCKET_MS, self.GROWTH))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, fraction):
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.FIRST_BUCKET_MS * self.GROWTH ** index, self.max_ms)
+        return self.max_ms
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total_ms / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(0.50),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': self.max_ms,
+        }
+###############################################################################
+# Totals for one (operation, table, index) group.
+###############################################################################
+class OperationStats:
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.read_units = 0.0
+        self.write_units = 0.0
+        self.items = 0
+        self.bytes = 0
+        self.errors = 0
+        self.throttles = 0
+
+    def summary(self):
+        summary = self.latency.summary()
+        summary.update({
+            'read_units': self.read_units,
+            'write_units': self.write_units,
+            'items': self.items,
+            'bytes': self.bytes,
+            'errors': self.errors,
+            'throttles': self.throttles,
+        })
+        return summary
+
+
+_lock = threading.Lock()
+_stats = {}
+_enabled = False
+
+
+def _stats_for(key):
+    stats = _stats.get(key)
+    if stats is None:
+        stats = _stats[key] = OperationStats()
+    return stats
+###############################################################################
+# botocore event handlers.
+###############################################################################
+def _before_parameter_build(params, model, context, **kwargs):
+    context['metrics_start'] = time.perf_counter()
+    if 'RequestItems' in params:
+        context['metrics_table'] = ','.join(sorted(params['RequestItems']))
+    else:
+        context['metrics_table'] = params.get('TableName', '')
+    context['metrics_index'] = params.get('IndexName', '')
+    if model.name in CAPACITY_OPERATIONS:
+        params.setdefault('ReturnConsumedCapacity', 'INDEXES')
+
+
+def _item_count(parsed):
+    if 'Count' in parsed:
+        return parsed['Count']
+    if 'Item' in parsed:
+        return 1
+    if 'Responses' in parsed and isinstance(parsed['Responses'], dict):
+        return sum(len(items) for items in parsed['Responses'].values())
+    return 0
+
+
+def _after_call(http_response, parsed, model, context, **kwargs):
+    start = context.get('metrics_start')
+    if start is None:
+        return
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    key = (model.name, context.get('metrics_table', ''),
+           context.get('metrics_index', ''))
+    consumed = parsed.get('ConsumedCapacity') or []
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    units = sum(c.get('CapacityUnits', 0.0) for c in consumed)
+    error_code = parsed.get('Error', {}).get('Code')
+    size = 0
+    if http_response is not None:
+        size = int(http_response.headers.get('content-length') or
+                   len(http_response.content or b''))
+    with _lock:
+        stats = _stats_for(key)
+        stats.latency.add(elapsed_ms)
+        if model.name in WRITE_OPERATIONS:
+            stats.write_units += units
+        else:
+            stats.read_units += units
+        stats.items += _item_count(parsed)
+        stats.bytes += size
+        if error_code:
+            stats.errors += 1
+
+
+def _needs_retry(response, operation, request_dict, **kwargs):
+    # Runs after every attempt, so throttles that botocore retried on its
+    # own are counted too. Returning None leaves the retry decision alone.
+    if not response:
+        return None
+    error_code = response[1].get('Error', {}).get('Code')
+    if error_code in dynamodb_throttle.THROTTLE_CODES:
+        context = request_dict.get('context', {})
+        key = (operation.name, context.get('metrics_table', ''),
+               context.get('metrics_index', ''))
+        with _lock:
+            _stats_for(key).throttles += 1
+    return None
+
+
+def instrument(client):
+    events = client.meta.events
+    events.register('before-parameter-build.dynamodb', _before_parameter_build)
+    events.register('after-call.dynamodb', _after_call)
+    events.register('needs-retry.dynamodb', _needs_retry)
+###############################################################################
+# Public API.
+###############################################################################
+def enable():
+    global _enabled
+    if not _enabled:
+        aws_clients.add_client_hook('dynamodb', instrument)
+        _enabled = True
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def snapshot():
+    with _lock:
+        groups = [
+            dict(operation=operation, table=table, index=index, **stats.summary())
+            for (operation, table, index), stats in sorted(_stats.items())
+        ]
+    return {'time': time.time(), 'operations': groups}
+
+
+def dump(path):
+    # Write to a temporary file first so readers never see half a file.
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot(), f, indent=2)
+    os.replace(tmp_path, path)
+###############################################################################
+# Dump a snapshot to path every interval seconds on a daemon thread.
+# Returns an Event; set it to stop dumping (one last dump is written).
+###############################################################################
+def start_periodic_dump(path, interval=60.0):
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            dump(path)
+        dump(path)
+
+    threading.Thread(target=run, name='dynamodb-metrics-dump', daemon=True).start()
+    return stop
@@ -0,0 +1,147 @@
+from decimal import Decimal
+###############################################################################
+# Typed records for the Guitar and DogToys tables.
+# Records use __slots__ and convert straight to and from the DynamoDb
+# attribute-value format ({'S': ...} / {'N': ...}) without going through
+# boto3's generic TypeSerializer/TypeDeserializer.
+# number is the type prices are read into: Decimal (exact) or float (faster,
+# smaller).
+###############################################################################
+class Record:
+
+    __slots__ = ()
+    # (attribute name, DynamoDb type) for every attribute, in order.
+    FIELDS = ()
+
+    def __init__(self, *args, **kwargs):
+        names = [name for name, _ in self.FIELDS]
+        values = dict(zip(names, args))
+        values.update(kwargs)
+        for name in names:
+            setattr(self, name, values.get(name))
+
+    def __repr__(self):
+        values = ', '.join(f'{name}={getattr(self, name)!r}'
+                           for name, _ in self.FIELDS)
+        return f'{type(self).__name__}({values})'
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name)
+            for name, _ in self.FIELDS)
+
+    def key(self):
+        return (self.pk, self.sk)
+
+    def to_item(self):
+        item = {}
+        for name, kind in self.FIELDS:
+            value = getattr(self, name)
+            if value is None:
+                continue
+            if kind == 'N':
+                item[name] = {'N': str(value)}
+            else:
+                item[name] = {'S': value}
+        return item
+
+    @classmethod
+    def from_item(cls, item, number=Decimal):
+        record = cls.__new__(cls)
+        for name, kind in cls.FIELDS:
+            value = item.get(name)
+            if value is None:
+                setattr(record, name, None)
+            elif kind == 'N':
+                setattr(record, name, number(value['N']))
+            else:
+                setattr(record, name, value['S'])
+        return record
+
+    @classmethod
+    def from_items(cls, items, number=Decimal):
+        from_item = cls.from_item
+        return [from_item(item, number) for item in items]
+
+
+class Guitar(Record):
+
+    __slots__ = ('pk', 'sk', 'brand', 'model', 'description', 'price')
+    FIELDS = (
+        ('pk', 'S'),
+        ('sk', 'S'),
+        ('brand', 'S'),
+        ('model', 'S'),
+        ('description', 'S'),
+        ('price', 'N'),
+    )
+
+
+class DogToy(Record):
+
+    __slots__ = ('pk', 'sk', 'vendor', 'title', 'description', 'price')
+    FIELDS = (
+        ('pk', 'S'),
+        ('sk', 'S'),
+        ('vendor', 'S'),
+        ('title', 'S'),
+        ('description', 'S'),
+        ('price', 'N'),
+    )
+###############################################################################
+# Plain dict conversion for items of any shape.
+###############################################################################
+def serialize(value):
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, float, Decimal)):
+        return {'N': str(value)}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, (bytes, bytearray)):
+        return {'B': bytes(value)}
+    if isinstance(value, (list, tuple)):
+        return {'L': [serialize(v) for v in value]}
+    if isinstance(value, dict):
+        return {'M': {k: serialize(v) for k, v in value.items()}}
+    if isinstance(value, (set, frozenset)) and value:
+        sample = next(iter(value))
+        if isinstance(sample, str):
+            return {'SS': sorted(value)}
+        if isinstance(sample, (bytes, bytearray)):
+            return {'BS': [bytes(v) for v in value]}
+        return {'NS': [str(v) for v in value]}
+    raise TypeError(f'Cannot store {type(value).__name__} in DynamoDb')
+
+
+def _deserialize_list(value, number):
+    return [deserialize(v, number) for v in value]
+
+
+def _deserialize_map(value, number):
+    return {k: deserialize(v, number) for k, v in value.items()}
+
+
+_DESERIALIZERS = {
+    'S': lambda value, number: value,
+    'N': lambda value, number: number(value),
+    'BOOL': lambda value, number: value,
+    'NULL': lambda value, number: None,
+    'B': lambda value, number: bytes(value),
+    'SS': lambda value, number: set(value),
+    'NS': lambda value, number: {number(v) for v in value},
+    'BS': lambda value, number: {bytes(v) for v in value},
+    'L': _deserialize_list,
+    'M': _deserialize_map,
+}
+
+
+def deserialize(value, number=Decimal):
+    (kind, inner), = value.items()
+    return _DESERIALIZERS[kind](inner, number)
+
+
+def item_to_dict(item, number=Decimal):
+    return {name: deserialize(value, number) for name, value in item.items()}
@@ -0,0 +1,168 @@
+import hashlib
+import io
+import s3functions
+###############################################################################
+# Offload large attributes to S3.
+# String or binary attributes bigger than `threshold` bytes are uploaded with
+# the s3functions helpers. The DynamoDb item keeps only a small pointer map:
+#   {'s3_bucket': ..., 's3_key': ..., 'sha256': ..., 'size': ..., 'type': 'S'}
+# Items stay far from the 400 KB limit, and every get, query and scan that
+# returns them uses fewer capacity units.
+#
+# Reads wrap items in LazyItem. A pointer is only downloaded the first time
+# its attribute is looked up, and it is checked against the stored size and
+# checksum. Queries that do not project the attribute never touch S3.
+###############################################################################
+THRESHOLD = 16 * 1024
+KEY_ATTRIBUTES = ('pk', 'sk')
+POINTER_FIELDS = ('s3_bucket', 's3_key', 'sha256', 'size', 'type')
+
+
+class OffloadError(Exception):
+    pass
+
+
+def is_pointer(value):
+    inner = value.get('M') if isinstance(value, dict) else None
+    return isinstance(inner, dict) and all(name in inner for name in POINTER_FIELDS)
+
+
+def _payload(value):
+    if 'S' in value:
+        return 'S', value['S'].encode('utf-8')
+    if 'B' in value:
+        return 'B', bytes(value['B'])
+    return None, None
+###############################################################################
+# Upload one value and return its pointer. The object name includes the
+# checksum, so a rewrite never changes an object a reader may be loading.
+###############################################################################
+def store(bucket, object_prefix, kind, data):
+    digest = hashlib.sha256(data).hexdigest()
+    object_name = f'{object_prefix}-{digest[:16]}'
+    if not s3functions.upload_file_obj(bucket, object_name, data):
+        raise OffloadError(f'Upload to s3://{bucket}/{object_name} failed')
+    return {'M': {
+        's3_bucket': {'S': bucket},
+        's3_key': {'S': object_name},
+        'sha256': {'S': digest},
+        'size': {'N': str(len(data))},
+        'type': {'S': kind},
+    }}
+
+
+def object_prefix(prefix, item, name):
+    return f'{prefix}{item["pk"]["S"]}/{item["sk"]["S"]}/{name}'
+###############################################################################
+# Return a copy of item with every large attribute replaced by a pointer.
+###############################################################################
+def offload_item(item, bucket, prefix='', threshold=THRESHOLD,
+                 key_attributes=KEY_ATTRIBUTES):
+    result = dict(item)
+    for name, value in item.items():
+        if name in key_attributes:
+            continue
+        kind, data = _payload(value)
+        if data is not None and len(data) > threshold:
+            result[name] = store(bucket, object_prefix(prefix, item, name), kind, data)
+    return result
+###############################################################################
+# Download a pointer's value and check it. Returns the attribute value.
+###############################################################################
+def load(pointer):
+    fields = pointer['M']
+    bucket, object_name = fields['s3_bucket']['S'], fields['s3_key']['S']
+    buffer = io.BytesIO()
+    if not s3functions.download_file_object(bucket, object_name, buffer):
+        raise OffloadError(f'Download of s3://{bucket}/{object_name} failed')
+    data = buffer.getvalue()
+    if len(data) != int(fields['size']['N']) or \
+            hashlib.sha256(data).hexdigest() != fields['sha256']['S']:
+        raise OffloadError(f's3://{bucket}/{object_name} does not match its checksum')
+    if fields['type']['S'] == 'S':
+        return {'S': data.decode('utf-8')}
+    return {'B': data}
+###############################################################################
+# Item whose offloaded attributes are loaded on first access.
+# Looking up one attribute loads only that one. Anything that sees the whole
+# item (items(), values(), iteration by dict(), ==, copy(), json) loads every
+# pointer first, so callers never get a pointer map instead of a value.
+# pointers() lists what is still in S3 without loading it.
+###############################################################################
+class LazyItem(dict):
+
+    def __getitem__(self, name):
+        value = dict.__getitem__(self, name)
+        if is_pointer(value):
+            value = load(value)
+            dict.__setitem__(self, name, value)
+        return value
+
+    def get(self, name, default=None):
+        if name in self:
+            return self[name]
+        return default
+
+    # Defining __iter__ makes dict(item) and {**item} go through keys() and
+    # __getitem__ instead of copying the raw storage.
+    def __iter__(self):
+        return dict.__iter__(self)
+
+    def items(self):
+        self.load_all()
+        return dict.items(self)
+
+    def values(self):
+        self.load_all()
+        return dict.values(self)
+
+    def copy(self):
+        return self.load_all()
+
+    def __eq__(self, other):
+        self.load_all()
+        if isinstance(other, LazyItem):
+            other.load_all()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def pointers(self):
+        return [name for name, value in dict.items(self) if is_pointer(value)]
+
+    def load_all(self):
+        for name in self.pointers():
+            self[name]
+        return {name: dict.__getitem__(self, name) for name in dict.keys(self)}
+
+
+def lazy(item):
+    if item is None or isinstance(item, LazyItem):
+        return item
+    if any(is_pointer(value) for value in item.values()):
+        return LazyItem(item)
+    return item
+
+
+def lazy_items(items):
+    for item in items:
+        yield lazy(item)
+###############################################################################
+# Delete the objects an item's pointers refer to, except those still used
+# by keep (the item that replaced it).
+###############################################################################
+def delete_objects(item, keep=None):
+    if not item:
+        return
+    kept = set()
+    for value in dict.values(keep or {}):
+        if is_pointer(value):
+            kept.add(value['M']['s3_key']['S'])
+    for value in dict.values(item):
+        if is_pointer(value) and value['M']['s3_key']['S'] not in kept:
+            s3functions.delete_object(value['M']['s3_bucket']['S'],
+                                      value['M']['s3_key']['S'])
@@ -0,0 +1,204 @@
+import heapq
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+QUEUE_SIZE = 1000
+###############################################################################
+# Follow LastEvaluatedKey through every page of a Query or Scan.
+# operation is a bound call such as db_client.query or table.scan, kwargs are
+# its request parameters. page_size sets Limit on each request.
+#
+# With prefetch=True the next page is requested on a background thread as
+# soon as the current one arrives, so the network round trip overlaps with
+# the caller's work on the current page. At most one page is read ahead.
+###############################################################################
+def pages(operation, page_size=None, prefetch=False, **kwargs):
+    if page_size:
+        kwargs['Limit'] = page_size
+    if not prefetch:
+        while True:
+            response = operation(**kwargs)
+            yield response
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    try:
+        future = pool.submit(operation, **kwargs)
+        while future is not None:
+            response = future.result()
+            future = None
+            if 'LastEvaluatedKey' in response:
+                kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+                future = pool.submit(operation, **kwargs)
+            yield response
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+###############################################################################
+# Same as pages(), one item at a time.
+###############################################################################
+def items(operation, page_size=None, prefetch=False, **kwargs):
+    for response in pages(operation, page_size, prefetch, **kwargs):
+        yield from response.get('Items', [])
+###############################################################################
+# Parallel Scan: one worker per Segment, each paging through its whole
+# segment. Items from all segments are merged into one iterator through a
+# bounded queue, so workers block instead of piling up results the caller
+# has not read yet.
+# progress(segment, items_so_far, finished) is called after every page.
+# https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/Scan.html#Scan.ParallelScan
+###############################################################################
+_DONE = object()
+
+
+def parallel_items(operation, total_segments, page_size=None, progress=None,
+                   queue_size=QUEUE_SIZE, **kwargs):
+    results = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(value):
+        while not stop.is_set():
+            try:
+                results.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def scan_segment(segment):
+        count = 0
+        try:
+            for response in pages(operation, page_size, Segment=segment,
+                                  TotalSegments=total_segments, **kwargs):
+                for item in response.get('Items', []):
+                    if not put(item):
+                        return
+                count += len(response.get('Items', []))
+                if progress:
+                    progress(segment, count, 'LastEvaluatedKey' not in response)
+        except Exception as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    pool = ThreadPoolExecutor(max_workers=total_segments)
+    try:
+        for segment in range(total_segments):
+            pool.submit(scan_segment, segment)
+        remaining = total_segments
+        while remaining:
+            value = results.get()
+            if value is _DONE:
+                remaining -= 1
+            elif isinstance(value, Exception):
+                raise value
+            else:
+                yield value
+    finally:
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+###############################################################################
+# Run several Queries at once and merge their items into one stream ordered
+# by sort_key(item). Every request must already return its items in that
+# order (the index range key order), as the shards of a sharded index or the
+# sub-ranges of a split key range do. Each request pages on its own worker
+# into a bounded queue, so all first pages are fetched in parallel.
+###############################################################################
+def merged_items(operation, requests, sort_key, reverse=False, page_size=None,
+                 queue_size=QUEUE_SIZE):
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=queue_size) for _ in requests]
+
+    def put(results, value):
+        while not stop.is_set():
+            try:
+                results.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(results, request):
+        try:
+            for response in pages(operation, page_size, **request):
+                for item in response.get('Items', []):
+                    if not put(results, item):
+                        return
+        except Exception as e:
+            put(results, e)
+        finally:
+            put(results, _DONE)
+
+    def drain(results):
+        while True:
+            value = results.get()
+            if value is _DONE:
+                return
+            if isinstance(value, Exception):
+                raise value
+            yield value
+
+    pool = ThreadPoolExecutor(max_workers=max(1, len(requests)))
+    try:
+        for results, request in zip(queues, requests):
+            pool.submit(run, results, dict(request))
+        yield from heapq.merge(*(drain(results) for results in queues),
+                               key=sort_key, reverse=reverse)
+    finally:
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+###############################################################################
+# Split the key range [low, high] into up to `parts` adjacent sub-ranges for
+# merged_items. Returns the boundaries low, b1, ..., high; neighbouring
+# BETWEEN ranges share a boundary, so an item equal to one is returned twice.
+# Numbers are split evenly. Strings are split by code point after their
+# common prefix, which is how DynamoDb orders them, reading the next
+# STRING_WIDTH characters as digits between the lowest and highest
+# character the two bounds use.
+###############################################################################
+STRING_WIDTH = 4
+
+
+def split_range(low, high, parts):
+    if parts <= 1 or not low < high:
+        return [low, high]
+    if isinstance(low, str):
+        points = _split_strings(low, high, parts)
+    elif isinstance(low, int) and isinstance(high, int):
+        points = [low + (high - low) * i // parts for i in range(1, parts)]
+    else:
+        points = [low + (high - low) * i / parts for i in range(1, parts)]
+    return [low] + sorted(set(p for p in points if low < p < high)) + [high]
+
+
+def _split_strings(low, high, parts):
+    prefix = os.path.commonprefix([low, high])
+    suffixes = [value[len(prefix):len(prefix) + STRING_WIDTH] for value in (low, high)]
+    codes = [ord(c) for c in ''.join(suffixes)]
+    if len(suffixes[0]) < STRING_WIDTH:
+        # low runs out first; pad it with something below printable text.
+        codes.append(ord(' '))
+    floor = min(codes)
+    base = max(codes) - floor + 1
+
+    def number(suffix):
+        digits = [ord(c) - floor for c in suffix]
+        digits += [0] * (STRING_WIDTH - len(digits))
+        result = 0
+        for digit in digits:
+            result = result * base + digit
+        return result
+
+    def string(value):
+        chars = []
+        for _ in range(STRING_WIDTH):
+            value, digit = divmod(value, base)
+            code = floor + digit
+            # Surrogates are not valid characters; the next one up keeps the order.
+            chars.append(chr(0xE000 if 0xD800 <= code < 0xE000 else code))
+        return prefix + ''.join(reversed(chars))
+
+    first, last = number(suffixes[0]), number(suffixes[1])
+    return [string(first + (last - first) * i // parts) for i in range(1, parts)]
@@ -0,0 +1,184 @@
+import logging
+import aws_clients
+import dynamodb_paging
+import dynamodb_sharding
+###############################################################################
+# Pick the cheapest way to answer a predicate over pk, sk and price.
+# Conditions are given per attribute, either as a plain value (equality) or
+# as a tuple: ('<', v), ('<=', v), ('>', v), ('>=', v), ('between', lo, hi)
+# or ('begins_with', prefix).
+#
+# Access paths, cheapest first:
+#   GetItem on the table         pk = and sk =
+#   Query on the table           pk =, optional range on sk
+#   Query on the price index     sk =, optional range on price
+#   Query on the pk index        sk =, optional range on pk
+#   Scan                         anything else
+# Conditions the chosen key schema cannot use become a FilterExpression.
+# With shards > 0 the indexes are keyed on the sharded category key, and
+# index Queries are sent to every shard (see dynamodb_sharding).
+# https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/Query.KeyConditionExpressions.html
+###############################################################################
+ATTRIBUTE_TYPES = {'pk': 'S', 'sk': 'S', 'price': 'N'}
+OPERATORS = ('=', '<', '<=', '>', '>=', 'between', 'begins_with')
+
+GET_ITEM = 'GetItem'
+QUERY = 'Query'
+SCAN = 'Scan'
+
+
+class Plan:
+
+    def __init__(self, operation, table_name, index_name, request, description,
+                 scatter=None):
+        self.operation = operation
+        self.table_name = table_name
+        self.index_name = index_name
+        self.request = request
+        self.description = description
+        # (sk, shards, range_key) for a Query on a sharded index.
+        self.scatter = scatter
+
+    def __repr__(self):
+        return f'Plan({self.description})'
+###############################################################################
+# Turn a plain value or operator tuple into (operator, values).
+###############################################################################
+def normalize(attribute, condition):
+    if not isinstance(condition, tuple):
+        condition = ('=', condition)
+    operator, *values = condition
+    if operator not in OPERATORS:
+        raise ValueError(f'Unsupported operator {operator!r} on {attribute}')
+    if operator == 'begins_with' and ATTRIBUTE_TYPES[attribute] != 'S':
+        raise ValueError(f'begins_with needs a string attribute, not {attribute}')
+    expected = 2 if operator == 'between' else 1
+    if len(values) != expected:
+        raise ValueError(f'{operator} on {attribute} takes {expected} value(s)')
+    return operator, values
+###############################################################################
+# Build condition expressions with #name / :value placeholders.
+###############################################################################
+class _Expression:
+
+    def __init__(self):
+        self.names = {}
+        self.values = {}
+
+    def value(self, attribute, value):
+        placeholder = f':v{len(self.values)}'
+        kind = ATTRIBUTE_TYPES[attribute]
+        self.values[placeholder] = {kind: value if kind == 'S' else str(value)}
+        return placeholder
+
+    def condition(self, attribute, operator, values):
+        name = f'#{attribute}'
+        self.names[name] = attribute
+        placeholders = [self.value(attribute, v) for v in values]
+        if operator == 'between':
+            return f'{name} BETWEEN {placeholders[0]} AND {placeholders[1]}'
+        if operator == 'begins_with':
+            return f'begins_with({name}, {placeholders[0]})'
+        return f'{name} {operator} {placeholders[0]}'
+###############################################################################
+# Choose the access path for a predicate and build its request.
+###############################################################################
+def plan(table_name, pk_index_name, price_index_name, pk=None, sk=None,
+         price=None, projection=None, consistent_read=False, shards=0):
+    conditions = {}
+    for attribute, condition in (('pk', pk), ('sk', sk), ('price', price)):
+        if condition is not None:
+            conditions[attribute] = normalize(attribute, condition)
+
+    def is_equal(attribute):
+        return conditions.get(attribute, (None,))[0] == '='
+
+    request = {'TableName': table_name}
+    expression = _Expression()
+    if projection:
+        for name in projection:
+            expression.names[f'#{name}'] = name
+        request['ProjectionExpression'] = ', '.join(f'#{name}' for name in projection)
+
+    if is_equal('pk') and is_equal('sk') and 'price' not in conditions:
+        request['Key'] = {
+            'pk': {'S': conditions['pk'][1][0]},
+            'sk': {'S': conditions['sk'][1][0]},
+        }
+        request['ConsistentRead'] = consistent_read
+        if expression.names:
+            request['ExpressionAttributeNames'] = expression.names
+        return Plan(GET_ITEM, table_name, None, request,
+                    f'GetItem on {table_name}')
+
+    if is_equal('pk'):
+        operation, index_name, hash_key, range_key = QUERY, None, 'pk', 'sk'
+    elif is_equal('sk') and ('price' in conditions or 'pk' not in conditions):
+        operation, index_name, hash_key, range_key = QUERY, price_index_name, 'sk', 'price'
+    elif is_equal('sk'):
+        operation, index_name, hash_key, range_key = QUERY, pk_index_name, 'sk', 'pk'
+    else:
+        operation, index_name, hash_key, range_key = SCAN, None, None, None
+
+    key_conditions = []
+    scatter = None
+    if operation == QUERY and index_name and shards:
+        sk_value = conditions.pop(hash_key)[1][0]
+        scatter = (sk_value, shards, range_key)
+        expression.names['#shard'] = dynamodb_sharding.SHARD_ATTRIBUTE
+        key_conditions.append(f'#shard = {dynamodb_sharding.SHARD_PLACEHOLDER}')
+        # The merge needs the range key on every item.
+        if projection and range_key not in projection:
+            expression.names[f'#{range_key}'] = range_key
+            request['ProjectionExpression'] += f', #{range_key}'
+    elif operation == QUERY:
+        key_conditions.append(expression.condition(hash_key, *conditions.pop(hash_key)))
+    if operation == QUERY:
+        if range_key in conditions:
+            key_conditions.append(expression.condition(range_key, *conditions.pop(range_key)))
+        request['KeyConditionExpression'] = ' AND '.join(key_conditions)
+        if index_name:
+            request['IndexName'] = index_name
+        else:
+            request['ConsistentRead'] = consistent_read
+    filters = [expression.condition(attribute, operator, values)
+               for attribute, (operator, values) in conditions.items()]
+    if filters:
+        request['FilterExpression'] = ' AND '.join(filters)
+    if expression.names:
+        request['ExpressionAttributeNames'] = expression.names
+    if expression.values:
+        request['ExpressionAttributeValues'] = expression.values
+
+    target = f'{table_name}.{index_name}' if index_name else table_name
+    description = f'{operation} on {target}'
+    if key_conditions:
+        description += f' key [{request["KeyConditionExpression"]}]'
+    if filters:
+        description += f' filter [{request["FilterExpression"]}]'
+    if scatter:
+        description += f' over {shards} shards of {scatter[0]!r}'
+    return Plan(operation, table_name, index_name, request, description, scatter)
+###############################################################################
+# Run a plan and yield the matching items.
+# Scans use segments parallel workers when segments > 1.
+###############################################################################
+def execute(plan, endpoint_url=None, page_size=None, segments=1):
+    logging.info(f'Query plan: {plan.description}')
+    db_client = aws_clients.dynamodb_client(endpoint_url)
+    request = dict(plan.request)
+    if plan.operation == GET_ITEM:
+        item = db_client.get_item(**request).get('Item')
+        if item is not None:
+            yield item
+    elif plan.scatter:
+        sk, shards, range_key = plan.scatter
+        yield from dynamodb_sharding.scatter_query(db_client.query, request, sk,
+                                                   shards, range_key, page_size)
+    elif plan.operation == QUERY:
+        yield from dynamodb_paging.items(db_client.query, page_size, **request)
+    elif segments > 1:
+        yield from dynamodb_paging.parallel_items(db_client.scan, segments,
+                                                  page_size, **request)
+    else:
+        yield from dynamodb_paging.items(db_client.scan, page_size, **request)
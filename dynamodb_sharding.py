@@ -0,0 +1,126 @@
+import logging
+import zlib
+from collections import Counter
+from decimal import Decimal
+import aws_clients
+import dynamodb_paging
+###############################################################################
+# Write sharding for the category GSIs.
+# Both tables' GSIs are keyed on sk, so every item of a category ("guitar",
+# "DogTreat") lands on one index partition and that partition throttles.
+# With sharding on, items also carry SHARD_ATTRIBUTE = "<sk>#<n>", where n is
+# computed from pk, and the GSIs are keyed on that instead of sk. A category
+# is then spread over `shards` partitions.
+#
+# sk itself is left alone because it is also the table's sort key.
+# Reads send one Query per shard in parallel and merge the results in index
+# order (price for the price index, pk for the pk index).
+###############################################################################
+SHARD_ATTRIBUTE = 'sk_shard'
+SHARDS = 8
+SHARD_PLACEHOLDER = ':shard'
+TOP_KEYS = 10
+###############################################################################
+# Shard numbers come from pk, so rewriting an item keeps it on its shard.
+###############################################################################
+def shard_of(pk, shards=SHARDS):
+    return zlib.crc32(pk.encode('utf-8')) % shards
+
+
+def shard_key(sk, shard):
+    return f'{sk}#{shard}'
+
+
+def shard_keys(sk, shards=SHARDS):
+    return [shard_key(sk, shard) for shard in range(shards)]
+
+
+def add_shard_key(item, shards=SHARDS):
+    item[SHARD_ATTRIBUTE] = {
+        'S': shard_key(item['sk']['S'], shard_of(item['pk']['S'], shards)),
+    }
+    return item
+###############################################################################
+# Sort value of an attribute-value item, numbers compared as numbers.
+###############################################################################
+def sort_value(attribute):
+    def value(item):
+        (kind, raw), = item[attribute].items()
+        return Decimal(raw) if kind == 'N' else raw
+    return value
+###############################################################################
+# Scatter-gather Query over every shard of sk.
+# request is a normal Query request whose KeyConditionExpression compares
+# SHARD_ATTRIBUTE with SHARD_PLACEHOLDER; the placeholder is filled in per
+# shard. Items come back merged in range_key order (descending if
+# ScanIndexForward is False).
+###############################################################################
+def scatter_query(operation, request, sk, shards=SHARDS, range_key='price',
+                  page_size=None):
+    requests = []
+    for key in shard_keys(sk, shards):
+        shard_request = dict(request)
+        shard_request['ExpressionAttributeValues'] = dict(
+            request.get('ExpressionAttributeValues', {}), **{SHARD_PLACEHOLDER: {'S': key}})
+        requests.append(shard_request)
+    reverse = request.get('ScanIndexForward') is False
+    return dynamodb_paging.merged_items(operation, requests, sort_value(range_key),
+                                        reverse, page_size)
+###############################################################################
+# Write skew report: how evenly items are spread over the values of an
+# index hash key. Run it on sk to find hot categories, and on
+# SHARD_ATTRIBUTE to check that sharding spreads them out.
+# skew is the busiest key's item count over the mean count per key; 1.0 is
+# perfectly even.
+###############################################################################
+def write_skew(values, top=TOP_KEYS):
+    counts = Counter(values)
+    total = sum(counts.values())
+    if not counts:
+        return {'items': 0, 'keys': 0, 'skew': 0.0, 'top': []}
+    mean = total / len(counts)
+    return {
+        'items': total,
+        'keys': len(counts),
+        'skew': max(counts.values()) / mean,
+        'top': [(key, count, count / total) for key, count in counts.most_common(top)],
+    }
+
+
+def table_skew(table_name, attribute='sk', endpoint_url=None, segments=4,
+               top=TOP_KEYS):
+    db_client = aws_clients.dynamodb_client(endpoint_url)
+    items = dynamodb_paging.parallel_items(
+        db_client.scan, segments,
+        ProjectionExpression='#k',
+        ExpressionAttributeNames={'#k': attribute},
+        TableName=table_name,
+    )
+    values = (item[attribute]['S'] for item in items if attribute in item)
+    return write_skew(values, top)
+
+
+def print_skew(report, attribute):
+    print(f'{report["items"]} items over {report["keys"]} {attribute} values, '
+          f'skew {report["skew"]:.2f}')
+    for key, count, share in report['top']:
+        print(f'  {key:<30}{count:>10}{share:>8.1%}')
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Report write skew over an index key.')
+    parser.add_argument('table')
+    parser.add_argument('--attribute', default='sk',
+                        help=f'index hash key to report on (sk or {SHARD_ATTRIBUTE})')
+    parser.add_argument('--endpoint')
+    parser.add_argument('--segments', type=int, default=4)
+    parser.add_argument('--top', type=int, default=TOP_KEYS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    report = table_skew(args.table, args.attribute, args.endpoint, args.segments, args.top)
+    print_skew(report, args.attribute)
+
+
+if __name__ == '__main__':
+    main()
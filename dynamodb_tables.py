@@ -0,0 +1,188 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+import aws_clients
+from botocore.exceptions import ClientError
+###############################################################################
+# DynamoDb table lifecycle: build the table definition, create it only if it
+# is missing, compare an existing table with the definition, and wait for the
+# table and its GSIs to become ACTIVE.
+###############################################################################
+PROVISIONED = 'PROVISIONED'
+PAY_PER_REQUEST = 'PAY_PER_REQUEST'
+
+WAIT_FIRST_DELAY = 0.05
+WAIT_MAX_DELAY = 5.0
+WAIT_TIMEOUT = 300
+###############################################################################
+# Build create_table arguments for a pk/sk table with a GSI on (sk, pk) and
+# a GSI on (sk, price), the layout used by the Guitar and DogToys tables.
+# billing_mode=PAY_PER_REQUEST gives an on-demand table with no throughput.
+# With shard_attribute the GSIs are keyed on that attribute instead of sk
+# (see dynamodb_sharding).
+###############################################################################
+def table_definition(table_name, pk_index_name, price_index_name,
+                     billing_mode=PROVISIONED, read_capacity=2,
+                     write_capacity=2, shard_attribute=None):
+    throughput = {
+        'ReadCapacityUnits': read_capacity,
+        'WriteCapacityUnits': write_capacity,
+    }
+
+    def index(name, range_key):
+        definition = {
+            'IndexName': name,
+            'KeySchema': [
+                {'AttributeName': shard_attribute or 'sk', 'KeyType': 'HASH'},
+                {'AttributeName': range_key, 'KeyType': 'RANGE'},
+            ],
+            'Projection': {'ProjectionType': 'ALL'},
+        }
+        if billing_mode == PROVISIONED:
+            definition['ProvisionedThroughput'] = dict(throughput)
+        return definition
+
+    definition = {
+        'TableName': table_name,
+        'AttributeDefinitions': [
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'},
+            {'AttributeName': 'price', 'AttributeType': 'N'},
+        ],
+        'KeySchema': [
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        'GlobalSecondaryIndexes': [
+            index(pk_index_name, 'pk'),
+            index(price_index_name, 'price'),
+        ],
+        'BillingMode': billing_mode,
+    }
+    if shard_attribute:
+        definition['AttributeDefinitions'].append(
+            {'AttributeName': shard_attribute, 'AttributeType': 'S'})
+    if billing_mode == PROVISIONED:
+        definition['ProvisionedThroughput'] = throughput
+    return definition
+###############################################################################
+# Describe a table, None if it does not exist.
+###############################################################################
+def describe(table_name, endpoint_url=None):
+    db_client = aws_clients.dynamodb_client(endpoint_url)
+    try:
+        return db_client.describe_table(TableName=table_name)['Table']
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ResourceNotFoundException':
+            return None
+        raise
+###############################################################################
+# List how an existing table differs from a definition. Empty means equal.
+###############################################################################
+def schema_diff(definition, description):
+    differences = []
+
+    def keys(schema):
+        return [(k['AttributeName'], k['KeyType']) for k in schema]
+
+    if keys(definition['KeySchema']) != keys(description['KeySchema']):
+        differences.append('key schema')
+
+    wanted = {a['AttributeName']: a['AttributeType']
+              for a in definition['AttributeDefinitions']}
+    actual = {a['AttributeName']: a['AttributeType']
+              for a in description.get('AttributeDefinitions', [])}
+    for name, kind in wanted.items():
+        if actual.get(name) != kind:
+            differences.append(f'attribute {name}')
+
+    billing = description.get('BillingModeSummary', {}).get('BillingMode',
+                                                            PROVISIONED)
+    if billing != definition.get('BillingMode', PROVISIONED):
+        differences.append(f'billing mode {billing}')
+    elif billing == PROVISIONED:
+        wanted_throughput = definition['ProvisionedThroughput']
+        actual_throughput = description.get('ProvisionedThroughput', {})
+        for name in ('ReadCapacityUnits', 'WriteCapacityUnits'):
+            if wanted_throughput[name] != actual_throughput.get(name):
+                differences.append(f'table {name}')
+
+    actual_indexes = {i['IndexName']: i
+                      for i in description.get('GlobalSecondaryIndexes', [])}
+    for index in definition.get('GlobalSecondaryIndexes', []):
+        existing = actual_indexes.pop(index['IndexName'], None)
+        if existing is None:
+            differences.append(f'missing index {index["IndexName"]}')
+        elif keys(index['KeySchema']) != keys(existing['KeySchema']):
+            differences.append(f'index {index["IndexName"]} key schema')
+    for name in actual_indexes:
+        differences.append(f'extra index {name}')
+    return differences
+###############################################################################
+# Wait until the table and all of its GSIs are ACTIVE.
+# Polls quickly at first (DynamoDB Local is ready within milliseconds) and
+# backs off towards WAIT_MAX_DELAY for real tables. Returns True when ready,
+# False on timeout.
+###############################################################################
+def wait_for_table(table_name, endpoint_url=None, timeout=WAIT_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    delay = WAIT_FIRST_DELAY
+    while True:
+        table = describe(table_name, endpoint_url)
+        if table is not None and table['TableStatus'] == 'ACTIVE' and all(
+                index['IndexStatus'] == 'ACTIVE'
+                for index in table.get('GlobalSecondaryIndexes', [])):
+            return True
+        if time.monotonic() + delay > deadline:
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, WAIT_MAX_DELAY)
+###############################################################################
+# Wait until a deleted table is gone.
+###############################################################################
+def wait_for_table_deleted(table_name, endpoint_url=None, timeout=WAIT_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    delay = WAIT_FIRST_DELAY
+    while describe(table_name, endpoint_url) is not None:
+        if time.monotonic() + delay > deadline:
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, WAIT_MAX_DELAY)
+    return True
+###############################################################################
+# Create the table if it is missing, otherwise compare it with the
+# definition. Returns (created, differences); differences are logged but the
+# existing table is left alone.
+###############################################################################
+def ensure_table(definition, endpoint_url=None, wait=True):
+    table_name = definition['TableName']
+    db_client = aws_clients.dynamodb_client(endpoint_url)
+    created = False
+    differences = []
+    description = describe(table_name, endpoint_url)
+    if description is None:
+        try:
+            db_client.create_table(**definition)
+            created = True
+        except ClientError as e:
+            # Someone else created it between describe and create.
+            if e.response['Error']['Code'] != 'ResourceInUseException':
+                raise
+    if not created:
+        description = description or describe(table_name, endpoint_url)
+        differences = schema_diff(definition, description)
+        for difference in differences:
+            logging.warning(f'Table {table_name} differs from definition: {difference}')
+    if wait and not wait_for_table(table_name, endpoint_url):
+        raise TimeoutError(f'Table {table_name} did not become ACTIVE')
+    return created, differences
+###############################################################################
+# Ensure several tables at once. Creation and the ACTIVE wait run in
+# parallel, so the total time is that of the slowest table.
+# Returns {table_name: (created, differences)}.
+###############################################################################
+def ensure_tables(definitions, endpoint_url=None, wait=True):
+    with ThreadPoolExecutor(max_workers=max(1, len(definitions))) as pool:
+        futures = {d['TableName']: pool.submit(ensure_table, d, endpoint_url, wait)
+                   for d in definitions}
+        return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,180 @@
+import logging
+import threading
+import time
+import aws_clients
+from botocore.exceptions import ClientError
+###############################################################################
+# Capacity-aware rate limiting for DynamoDb.
+# Every call reserves capacity units from a token bucket, then settles the
+# reservation with the ConsumedCapacity DynamoDb reports, so large items slow
+# the caller down and small ones speed it up. The bucket's refill rate adapts:
+# it creeps up while calls succeed and halves on throttling, settling at the
+# highest rate the table sustains.
+#
+# The shared clients retry throttles themselves (aws_clients.RETRY_MODE), so
+# most throttles never reach the caller as an error. A needs-retry handler on
+# every DynamoDb client reports each throttled attempt to the bucket of the
+# limited call running on that thread.
+###############################################################################
+READ = 'read'
+WRITE = 'write'
+
+THROTTLE_CODES = (
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+)
+ON_DEMAND_RATE = 1000.0
+INCREASE = 1.05
+DECREASE = 0.5
+MAX_RETRIES = 10
+# Bucket of the limited call in progress on this thread, and how many of its
+# attempts the client has seen throttled.
+_active = threading.local()
+
+
+def is_throttle(error):
+    return (isinstance(error, ClientError)
+            and error.response.get('Error', {}).get('Code') in THROTTLE_CODES)
+
+
+def _needs_retry(response, **kwargs):
+    # Runs after every attempt, including the ones botocore retries on its
+    # own. Returning None leaves the retry decision alone.
+    bucket = getattr(_active, 'bucket', None)
+    if bucket is None or not response:
+        return None
+    if response[1].get('Error', {}).get('Code') in THROTTLE_CODES:
+        bucket.throttled()
+        _active.throttles += 1
+    return None
+
+
+def watch(client):
+    client.meta.events.register('needs-retry.dynamodb', _needs_retry)
+###############################################################################
+# Sum CapacityUnits from a response; batch calls return a list per table.
+###############################################################################
+def consumed_units(response):
+    consumed = response.get('ConsumedCapacity')
+    if consumed is None:
+        return None
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    return sum(c.get('CapacityUnits', 0.0) for c in consumed)
+###############################################################################
+# Token bucket with a refill rate that adapts to throttling.
+# Tokens may go negative when a call consumes more than it reserved; the debt
+# is paid off by later refills before anyone else gets through.
+###############################################################################
+class AdaptiveBucket:
+
+    def __init__(self, rate, max_rate=None, min_rate=1.0, burst_seconds=1.0):
+        self.rate = float(rate)
+        self.max_rate = float(max_rate or rate * 4)
+        self.min_rate = min(float(min_rate), self.rate)
+        self.burst_seconds = burst_seconds
+        self.tokens = self.rate * burst_seconds
+        self.throttles = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        capacity = self.rate * self.burst_seconds
+        self.tokens = min(capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, units):
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= min(units, self.rate * self.burst_seconds):
+                    self.tokens -= units
+                    return
+                wait = (units - self.tokens) / self.rate
+            time.sleep(min(max(wait, 0.001), 1.0))
+
+    def settle(self, reserved, consumed):
+        with self._lock:
+            self.tokens -= consumed - reserved
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate * INCREASE)
+
+    def throttled(self):
+        with self._lock:
+            self.throttles += 1
+            self.rate = max(self.min_rate, self.rate * DECREASE)
+            self.tokens = min(self.tokens, 0.0)
+###############################################################################
+# Read and write buckets for one table.
+# wrap(kind, operation) returns a drop-in replacement for a client method
+# (db_client.scan, db_client.batch_write_item, ...) that waits for capacity,
+# asks for ReturnConsumedCapacity and retries throttling errors itself.
+###############################################################################
+class CapacityLimiter:
+
+    def __init__(self, read_rate, write_rate, max_read_rate=None,
+                 max_write_rate=None):
+        self.buckets = {
+            READ: AdaptiveBucket(read_rate, max_read_rate),
+            WRITE: AdaptiveBucket(write_rate, max_write_rate),
+        }
+        # Running estimate of units per call, per operation.
+        self._estimates = {}
+        aws_clients.add_client_hook('dynamodb', watch)
+
+    @classmethod
+    def for_table(cls, table_name, endpoint_url=None):
+        db_client = aws_clients.dynamodb_client(endpoint_url)
+        table = db_client.describe_table(TableName=table_name)['Table']
+        billing = table.get('BillingModeSummary', {}).get('BillingMode')
+        throughput = table.get('ProvisionedThroughput', {})
+        if billing == 'PAY_PER_REQUEST' or not throughput.get('ReadCapacityUnits'):
+            return cls(ON_DEMAND_RATE, ON_DEMAND_RATE)
+        return cls(throughput['ReadCapacityUnits'], throughput['WriteCapacityUnits'])
+
+    def throttled(self, kind):
+        self.buckets[kind].throttled()
+
+    def stats(self):
+        return {kind: {'rate': bucket.rate, 'throttles': bucket.throttles}
+                for kind, bucket in self.buckets.items()}
+
+    def call(self, kind, operation, **kwargs):
+        bucket = self.buckets[kind]
+        name = getattr(operation, '__name__', str(operation))
+        kwargs.setdefault('ReturnConsumedCapacity', 'TOTAL')
+        attempt = 0
+        while True:
+            estimate = self._estimates.get(name, 1.0)
+            bucket.acquire(estimate)
+            _active.bucket, _active.throttles = bucket, 0
+            try:
+                response = operation(**kwargs)
+            except ClientError as e:
+                bucket.settle(estimate, 0.0)
+                if not is_throttle(e) or attempt >= MAX_RETRIES:
+                    raise
+                # Operations not made by an aws_clients client are not watched.
+                if not _active.throttles:
+                    bucket.throttled()
+                logging.warning(f'{name} throttled, {kind} rate now {bucket.rate:.1f}/s')
+                attempt += 1
+                continue
+            finally:
+                _active.bucket = None
+            consumed = consumed_units(response)
+            if consumed is not None:
+                bucket.settle(estimate, consumed)
+                self._estimates[name] = estimate * 0.8 + consumed * 0.2
+            bucket.succeeded()
+            return response
+
+    def wrap(self, kind, operation):
+        def limited(**kwargs):
+            return self.call(kind, operation, **kwargs)
+        limited.__name__ = getattr(operation, '__name__', 'operation')
+        return limited
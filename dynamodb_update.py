@@ -0,0 +1,73 @@
+import aws_clients
+import dynamodb_models
+###############################################################################
+# Partial item updates with UpdateItem.
+# Only the named attributes are sent and written, so fixing a price does not
+# resend (or pay write capacity for) the rest of the item.
+#   set     {attribute: value}   SET attribute = value
+#   add     {attribute: number}  ADD to a number (negative to subtract)
+#   remove  [attribute, ...]     REMOVE attribute
+#   expected {attribute: value}  only update if attribute currently == value
+#   must_exist                   fail instead of creating a missing item
+# Returns the new values of the changed attributes (ReturnValues=UPDATED_NEW),
+# or whatever return_values asks for instead.
+# https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/Expressions.UpdateExpressions.html
+###############################################################################
+def build_update(key, set=None, add=None, remove=None, expected=None,
+                 must_exist=True, return_values='UPDATED_NEW'):
+    names = {}
+    placeholders = {}
+    values = {}
+
+    def name(attribute):
+        if attribute not in placeholders:
+            placeholders[attribute] = f'#n{len(names)}'
+            names[placeholders[attribute]] = attribute
+        return placeholders[attribute]
+
+    def value(python_value):
+        placeholder = f':v{len(values)}'
+        values[placeholder] = dynamodb_models.serialize(python_value)
+        return placeholder
+
+    clauses = []
+    if set:
+        clauses.append('SET ' + ', '.join(
+            f'{name(a)} = {value(v)}' for a, v in set.items()))
+    if add:
+        clauses.append('ADD ' + ', '.join(
+            f'{name(a)} {value(v)}' for a, v in add.items()))
+    if remove:
+        clauses.append('REMOVE ' + ', '.join(name(a) for a in remove))
+    if not clauses:
+        raise ValueError('Nothing to update')
+
+    conditions = []
+    if must_exist:
+        conditions.append(f'attribute_exists({name(next(iter(key)))})')
+    for attribute, expected_value in (expected or {}).items():
+        conditions.append(f'{name(attribute)} = {value(expected_value)}')
+
+    request = {
+        'Key': key,
+        'UpdateExpression': ' '.join(clauses),
+        'ExpressionAttributeNames': names,
+        'ReturnValues': return_values,
+    }
+    if values:
+        request['ExpressionAttributeValues'] = values
+    if conditions:
+        request['ConditionExpression'] = ' AND '.join(conditions)
+    return request
+
+
+def update_item(table_name, key, set=None, add=None, remove=None,
+                expected=None, must_exist=True, endpoint_url=None,
+                operation=None, return_values='UPDATED_NEW'):
+    request = build_update(key, set, add, remove, expected, must_exist,
+                           return_values)
+    if operation is None:
+        operation = aws_clients.dynamodb_client(endpoint_url).update_item
+    response = operation(TableName=table_name, ReturnConsumedCapacity='TOTAL',
+                         **request)
+    return response.get('Attributes', {})
@@ -0,0 +1,218 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import dynamodb_batch
+###############################################################################
+# Write-behind buffer that coalesces repeated writes to the same key.
+# put() and delete() only record the latest write per (pk, sk). The buffer is
+# flushed as BatchWriteItem chunks once `window` seconds have passed since the
+# first buffered write, or as soon as `max_items` distinct keys are waiting.
+# Several writes to one key inside a window cost one billed write.
+#
+# get() sees buffered writes (including ones being flushed right now), so a
+# process reads its own writes before they reach DynamoDb. Other processes
+# only see them after the flush.
+#
+# Writes are lost if the process dies before a flush; call flush() or close()
+# (or use the buffer as a context manager) before exiting.
+#
+# A chunk that fails to write goes back into the buffer (unless the key was
+# written again meanwhile) and is retried with the next flush. After
+# `max_attempts` failed flushes a write is dropped and its key passed to
+# on_drop. The error is raised by the next put(), delete() or flush().
+###############################################################################
+WINDOW = 0.05
+MAX_ITEMS = 500
+MAX_ATTEMPTS = 3
+DELETED = object()
+
+
+class WriteBehindBuffer:
+
+    def __init__(self, table_name, endpoint_url=None, window=WINDOW,
+                 max_items=MAX_ITEMS, max_workers=dynamodb_batch.MAX_WORKERS,
+                 limiter=None, key_attributes=dynamodb_batch.KEY_ATTRIBUTES,
+                 max_attempts=MAX_ATTEMPTS, on_drop=None):
+        self.table_name = table_name
+        self.endpoint_url = endpoint_url
+        self.window = window
+        self.max_items = max_items
+        self.limiter = limiter
+        self.key_attributes = key_attributes
+        self.max_attempts = max_attempts
+        self.on_drop = on_drop
+        self.writes = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.errors = []
+        self._pending = {}
+        self._flushing = {}
+        # Failed flushes so far, per key waiting to be retried.
+        self._attempts = {}
+        self._first_write = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._thread = threading.Thread(target=self._run, name='dynamodb-write-behind',
+                                        daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _key(self, item):
+        return dynamodb_batch.item_key(item, self.key_attributes)
+
+    def _raise_error(self):
+        with self._lock:
+            if not self.errors:
+                return
+            error, self.errors = self.errors[0], []
+        raise error
+
+    def _buffer(self, key, request):
+        self._raise_error()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Write-behind buffer is closed')
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = request
+            self.writes += 1
+            if self._first_write is None:
+                self._first_write = time.monotonic()
+            if len(self._pending) >= self.max_items or len(self._pending) == 1:
+                self._wake.notify()
+    ###########################################################################
+    # Buffer a write. key is the attribute-value key, item the full item.
+    ###########################################################################
+    def put(self, item):
+        self._buffer(self._key(item), {'PutRequest': {'Item': item}})
+
+    def delete(self, key):
+        self._buffer(self._key(key), {'DeleteRequest': {'Key': key}})
+    ###########################################################################
+    # Read-your-writes lookup. Returns the buffered item, DELETED if the key
+    # has a buffered delete, or None if nothing is buffered for it.
+    ###########################################################################
+    def get(self, key):
+        key = self._key(key)
+        with self._lock:
+            request = self._pending.get(key) or self._flushing.get(key)
+        if request is None:
+            return None
+        if 'DeleteRequest' in request:
+            return DELETED
+        return request['PutRequest']['Item']
+    ###########################################################################
+    # Write everything buffered so far and wait for it to land, retrying
+    # failed chunks until they land or are dropped.
+    # Raises the first error seen by any flush since the last call.
+    ###########################################################################
+    def flush(self):
+        for _ in range(self.max_attempts):
+            self._flush_pending()
+            with self._lock:
+                if not self._pending:
+                    break
+        self._raise_error()
+
+    def _flush_pending(self):
+        with self._flush_lock:
+            with self._lock:
+                batch = self._pending
+                self._pending = {}
+                self._first_write = None
+                self._flushing = batch
+            try:
+                if batch:
+                    self._write(list(batch.items()))
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+    def _write(self, requests):
+        size = dynamodb_batch.BATCH_WRITE_SIZE
+        chunks = [requests[i:i + size] for i in range(0, len(requests), size)]
+        futures = [self._pool.submit(dynamodb_batch.write_requests, self.table_name,
+                                     [request for _, request in chunk],
+                                     self.endpoint_url, self.limiter)
+                   for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            try:
+                self.flushed += future.result()
+            except Exception as e:
+                logging.error(e)
+                self._requeue(chunk, e)
+            else:
+                with self._lock:
+                    for key, _ in chunk:
+                        self._attempts.pop(key, None)
+
+    def _requeue(self, chunk, error):
+        dropped = []
+        with self._lock:
+            self.errors.append(error)
+            for key, request in chunk:
+                attempts = self._attempts.pop(key, 0) + 1
+                if key in self._pending:
+                    # Written again since; the newer write replaces this one.
+                    continue
+                if attempts >= self.max_attempts:
+                    dropped.append(key)
+                    continue
+                self._attempts[key] = attempts
+                self._pending[key] = request
+                if self._first_write is None:
+                    self._first_write = time.monotonic()
+            self.dropped += len(dropped)
+        if dropped:
+            logging.error(f'Dropped {len(dropped)} writes to {self.table_name} '
+                          f'after {self.max_attempts} failed flushes')
+            if self.on_drop is not None:
+                self.on_drop(dropped)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._closed:
+                    if self._first_write is not None:
+                        remaining = self._first_write + self.window - time.monotonic()
+                        if remaining <= 0 or len(self._pending) >= self.max_items:
+                            break
+                        self._wake.wait(remaining)
+                    else:
+                        self._wake.wait()
+                if self._closed:
+                    return
+            # Errors are logged and kept in self.errors for the next call.
+            self._flush_pending()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wake.notify()
+        self._thread.join()
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'writes': self.writes,
+                'flushed': self.flushed,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+                'pending': len(self._pending),
+            }
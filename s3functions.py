@@ -1,14 +1,23 @@
 import logging
 import requests
+import hashlib
 import io
-import boto3
-from botocore.exceptions import ClientError
+import mmap
+import os
+import random
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import aws_clients
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import BotoCoreError, ClientError
 ###############################################################################
 # Create an S3 bucket in a specified region.
 ###############################################################################
 def create_bucket(bucket_name, region):
     try:
-        s3_client = boto3.client('s3', region_name=region)
+        s3_client = aws_clients.s3_client(region=region)
         location = {'LocationConstraint': region}
         s3_client.create_bucket(Bucket=bucket_name, CreateBucketConfiguration={'LocationConstraint': 'us-west-1'})
     except ClientError as e:
@@ -22,7 +31,7 @@ def create_bucket(bucket_name, region):
 def list_all_buckets():
     
     try:
-        s3_client = boto3.client('s3')
+        s3_client = aws_clients.s3_client()
         response = s3_client.list_buckets()
     except ClientError as e:
         logging.error(e)
@@ -37,20 +46,119 @@ def list_all_buckets():
 ###############################################################################
 def upload_file(bucket_name, file_name, object_name):
     try:
-        s3_client = boto3.client('s3')
+        s3_client = aws_clients.s3_client()
         s3_client.upload_file(file_name, bucket_name, object_name)
     except ClientError as e:
         logging.error(e)
         return False
     return True
 ###############################################################################
+# Transfer settings for large files. Files over multipart_threshold are sent
+# in multipart_chunksize parts, max_concurrency parts at a time.
+# https://boto3.amazonaws.com/v1/documentation/api/latest/reference/customizations/s3.html#boto3.s3.transfer.TransferConfig
+###############################################################################
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+MAX_CONCURRENCY = 8
+
+
+def transfer_config(multipart_threshold=MULTIPART_THRESHOLD,
+                    multipart_chunksize=MULTIPART_CHUNKSIZE,
+                    max_concurrency=MAX_CONCURRENCY):
+    return TransferConfig(multipart_threshold=multipart_threshold,
+                          multipart_chunksize=multipart_chunksize,
+                          max_concurrency=max_concurrency,
+                          use_threads=max_concurrency > 1)
+###############################################################################
+# Files under a directory as (path, key), and the objects under a prefix as
+# {key: (size, last modified)}.
+###############################################################################
+def _local_files(directory, prefix):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            key = prefix + os.path.relpath(path, directory).replace(os.sep, '/')
+            yield path, key
+
+
+def _remote_objects(s3_client, bucket_name, prefix):
+    objects = {}
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for content in page.get("Contents", []):
+            objects[content['Key']] = (content['Size'], content['LastModified'].timestamp())
+    return objects
+###############################################################################
+# Upload a whole directory tree.
+# Keys are prefix + the path relative to directory, with / separators.
+# Files go up `workers` at a time on one shared client, so small files do
+# not wait on each other, and big ones are split by config (a
+# transfer_config()). Each worker can hold max_concurrency connections, so
+# by default workers is aws_clients.MAX_POOL_CONNECTIONS // max_concurrency
+# and uploads never queue for a connection.
+# With sync=True, files whose key already exists with the same size and is
+# not older than the local file are skipped.
+# Returns a summary with files, skipped, failed keys, bytes, seconds and MB/s,
+# or None if the existing objects could not be listed.
+###############################################################################
+def upload_directory(bucket_name, directory, prefix='', workers=None,
+                     config=None, sync=False):
+    config = config or transfer_config()
+    if workers is None:
+        parts = config.max_concurrency if config.use_threads else 1
+        workers = max(1, aws_clients.MAX_POOL_CONNECTIONS // parts)
+    s3_client = aws_clients.s3_client()
+    try:
+        remote = _remote_objects(s3_client, bucket_name, prefix) if sync else {}
+    except (ClientError, BotoCoreError) as e:
+        logging.error(e)
+        return None
+    summary = {'files': 0, 'skipped': 0, 'failed': [], 'bytes': 0}
+    start = time.monotonic()
+
+    def upload(path, key, size):
+        s3_client.upload_file(path, bucket_name, key, Config=config)
+        return size
+
+    def finish(done):
+        for future in done:
+            key = in_flight.pop(future)
+            try:
+                summary['bytes'] += future.result()
+                summary['files'] += 1
+            except (ClientError, BotoCoreError, S3UploadFailedError, OSError) as e:
+                logging.error(e)
+                summary['failed'].append(key)
+
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path, key in _local_files(directory, prefix):
+            stat = os.stat(path)
+            if key in remote and remote[key][0] == stat.st_size and \
+                    remote[key][1] >= stat.st_mtime:
+                summary['skipped'] += 1
+                continue
+            if len(in_flight) >= workers * 2:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                finish(done)
+            in_flight[pool.submit(upload, path, key, stat.st_size)] = key
+        finish(list(in_flight))
+
+    summary['seconds'] = time.monotonic() - start
+    summary['mb_per_s'] = summary['bytes'] / 1e6 / summary['seconds'] if summary['seconds'] else 0.0
+    logging.info(f"Uploaded {summary['files']} files ({summary['bytes'] / 1e6:.1f} MB) "
+                 f"to s3://{bucket_name}/{prefix} at {summary['mb_per_s']:.1f} MB/s, "
+                 f"{summary['skipped']} skipped, {len(summary['failed'])} failed")
+    return summary
+###############################################################################
 # Upload binary data to a bucket
 # Will automatically handle multipart uploads behind the scenes if necessary.
 ###############################################################################
 def upload_file_obj(bucket_name, file_name, binary_data):
     
     try:
-        s3_client = boto3.client('s3')
+        s3_client = aws_clients.s3_client()
         fo = io.BytesIO(binary_data)
         s3_client.upload_fileobj(fo, bucket_name, file_name)
     except ClientError as e:
@@ -63,7 +171,7 @@ def upload_file_obj(bucket_name, file_name, binary_data):
 ###############################################################################
 def put_object(bucket_name, object_name, file_name):
     try:
-        s3_client = boto3.client('s3')
+        s3_client = aws_clients.s3_client()
         with open(file_name, 'rb') as f:
             content = f.read()
         # Send the to the bucket
@@ -78,7 +186,7 @@ def put_object(bucket_name, object_name, file_name):
 ###############################################################################
 def download_file(bucket_name, object_name, file_name):
     try:
-        s3_client = boto3.client('s3')
+        s3_client = aws_clients.s3_client()
         s3_client.download_file(bucket_name, object_name, file_name)
     except ClientError as e:
         logging.error(e)
@@ -90,29 +198,155 @@ def download_file(bucket_name, object_name, file_name):
 ###############################################################################
 def download_file_object(bucket_name, object_name, fob):
     try:
-        s3_client = boto3.client('s3')
+        s3_client = aws_clients.s3_client()
         s3_client.download_fileobj(bucket_name, object_name, fob)
     except ClientError as e:
         logging.error(e)
         return False
     return True        
 ###############################################################################
-# Get an object - lower level API call.
-# Does not do multi-part downloads
+# Download an object to a file without holding it in memory.
+# The body is streamed in CHUNK_SIZE pieces. Objects over RANGE_THRESHOLD
+# (and every multipart upload) are fetched as parallel ranged GETs, each
+# written straight into a preallocated file at its offset: os.pwrite where
+# available, a memory map otherwise. A failed range is retried on its own.
+# Every range is pinned to the object's ETag with IfMatch, so an object that
+# changes mid-download fails instead of mixing versions.
+# The result is written to file_name + '.part' and renamed into place only
+# after the size and, when it is an MD5 (single or multipart), the ETag match.
 ###############################################################################
-def get_object(bucket_name, object_name, file_name):
+RANGE_THRESHOLD = 16 * 1024 * 1024
+RANGE_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_WORKERS = 8
+RANGE_RETRIES = 5
+RETRY_BASE_DELAY = 0.1
+RETRY_MAX_DELAY = 5.0
+FATAL_CODES = ('PreconditionFailed', 'NoSuchKey', 'AccessDenied', '403', '404', '412')
+
+
+class _OutputFile:
+
+    def __init__(self, path, size):
+        self.file = open(path, 'wb+')
+        self.file.truncate(size)
+        self.map = None
+        if not hasattr(os, 'pwrite') and size:
+            self.map = mmap.mmap(self.file.fileno(), size)
+
+    def write_at(self, offset, data):
+        if self.map is not None:
+            self.map[offset:offset + len(data)] = data
+            return
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.file.fileno(), view, offset)
+            view = view[written:]
+            offset += written
+
+    def size(self):
+        return os.fstat(self.file.fileno()).st_size
+
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+        self.file.close()
+
+
+def _download_range(s3_client, bucket_name, object_name, etag, start, end, out):
+    error = None
+    for attempt in range(RANGE_RETRIES + 1):
+        if attempt:
+            logging.warning(f'Retrying bytes {start}-{end} of {object_name}: {error}')
+            time.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)))
+        digest = hashlib.md5()
+        try:
+            response = s3_client.get_object(Bucket=bucket_name, Key=object_name,
+                                            Range=f'bytes={start}-{end}', IfMatch=etag)
+            offset = start
+            for chunk in response['Body'].iter_chunks(CHUNK_SIZE):
+                out.write_at(offset, chunk)
+                digest.update(chunk)
+                offset += len(chunk)
+            if offset != end + 1:
+                raise OSError(f'Got bytes {start}-{offset - 1}, expected up to {end}')
+            return digest.digest()
+        except ClientError as e:
+            if e.response['Error']['Code'] in FATAL_CODES:
+                raise
+            error = e
+        except (BotoCoreError, OSError) as e:
+            error = e
+    raise error
+
+
+def _file_md5(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_object(bucket_name, object_name, file_name, range_size=RANGE_SIZE,
+               workers=DOWNLOAD_WORKERS, verify=True):
+    tmp_name = f'{file_name}.part'
+    out = None
     try:
-        s3_client = boto3.client('s3')
-        s3_response_object = s3_client.get_object(Bucket=bucket_name, 
-Key=object_name)
-        # Get the "StreamingBody"...
-        object_content = s3_response_object['Body'].read()
-        
-        #Push the "StreamingBody" stream to a file.
-        with open(file_name, 'wb') as f:
-            f.write(object_content)
-    except ClientError as e:
+        s3_client = aws_clients.s3_client()
+        head = s3_client.head_object(Bucket=bucket_name, Key=object_name)
+        size, etag = head['ContentLength'], head['ETag']
+        md5_etag = etag.strip('"')
+        # SSE-KMS ETags are not MD5s of the data, so only the size is checked.
+        check_etag = verify and head.get('ServerSideEncryption') != 'aws:kms' and \
+            re.fullmatch(r'[0-9a-f]{32}(-\d+)?', md5_etag) is not None
+        multipart = '-' in md5_etag
+        if multipart:
+            # Ranges on the original part boundaries give the part MD5s.
+            range_size = s3_client.head_object(Bucket=bucket_name, Key=object_name,
+                                               PartNumber=1)['ContentLength']
+        elif size <= RANGE_THRESHOLD:
+            range_size = max(size, 1)
+        ranges = [(start, min(start + range_size, size) - 1)
+                  for start in range(0, size, range_size)]
+
+        out = _OutputFile(tmp_name, size)
+        if len(ranges) == 1:
+            digests = [_download_range(s3_client, bucket_name, object_name, etag,
+                                       *ranges[0], out)]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_download_range, s3_client, bucket_name,
+                                       object_name, etag, start, end, out)
+                           for start, end in ranges]
+                try:
+                    digests = [future.result() for future in futures]
+                finally:
+                    for future in futures:
+                        future.cancel()
+        written = out.size()
+        out.close()
+        out = None
+
+        if written != size:
+            raise OSError(f'{file_name}: wrote {written} bytes, object has {size}')
+        if check_etag:
+            if multipart:
+                actual = f'{hashlib.md5(b"".join(digests)).hexdigest()}-{len(digests)}'
+            elif len(digests) == 1:
+                actual = digests[0].hex()
+            else:
+                actual = _file_md5(tmp_name)
+            if size and actual != md5_etag:
+                raise OSError(f'{file_name}: checksum {actual} does not match ETag {md5_etag}')
+        os.replace(tmp_name, file_name)
+    except (ClientError, BotoCoreError, OSError) as e:
         logging.error(e)
+        if out is not None:
+            out.close()
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
         return False
     return True        
 ###############################################################################
@@ -122,7 +356,7 @@ Key=object_name)
 ###############################################################################
 def list_all_objects(bucket_name):
     try:
-        s3_client = boto3.client('s3')
+        s3_client = aws_clients.s3_client()
         paginator = s3_client.get_paginator("list_objects_v2")
         for page in paginator.paginate(Bucket=bucket_name):
             for content in page["Contents"]:
@@ -137,35 +371,86 @@ def list_all_objects(bucket_name):
 ###############################################################################
 def delete_object(bucket_name, object_name):
     try:
-        s3_client = boto3.client('s3')
+        s3_client = aws_clients.s3_client()
         s3_client.delete_object(Bucket=bucket_name, Key=object_name)
     except ClientError as e:
         logging.error(e)
         return False
     return True        
 ###############################################################################
-# Delete all objects in a bucket.
-# Uses paginators. 
-#See:https://boto3.amazonaws.com/v1/documentation/api/latest/guide/paginators.html
+# Delete all objects in a bucket, or only those under prefix.
+# Keys are listed with a paginator and deleted with DeleteObjects, up to
+# 1000 keys per call. Batches run on a worker pool while listing carries on.
+# Keys that a batch reports as errors are retried with backoff. Returns
+# False if any key could not be deleted.
+#See:https://docs.aws.amazon.com/AmazonS3/latest/API/API_DeleteObjects.html
 ###############################################################################
-def delete_all_objects(bucket_name):
+DELETE_BATCH_SIZE = 1000
+DELETE_WORKERS = 8
+DELETE_RETRIES = 5
+
+
+def _delete_batch(s3_client, bucket_name, keys):
+    for attempt in range(DELETE_RETRIES + 1):
+        if attempt:
+            time.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)))
+        response = s3_client.delete_objects(
+            Bucket=bucket_name,
+            Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True},
+        )
+        errors = response.get('Errors', [])
+        if not errors:
+            return []
+        keys = [error['Key'] for error in errors]
+    for error in errors:
+        logging.error(f"Could not delete {error['Key']}: {error.get('Code')} {error.get('Message')}")
+    return keys
+
+
+def delete_all_objects(bucket_name, prefix='', workers=DELETE_WORKERS):
+    failed = []
+    count = 0
+
+    def finish(done):
+        for future in done:
+            in_flight.remove(future)
+            failed.extend(future.result())
+
     try:
-        s3_client = boto3.client('s3')
+        s3_client = aws_clients.s3_client()
         paginator = s3_client.get_paginator("list_objects_v2")
-        for page in paginator.paginate(Bucket=bucket_name):
-            for content in page["Contents"]:
-                key = content['Key']    
-                s3_client.delete_object(Bucket=bucket_name, Key=key)
+        in_flight = set()
+        batch = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            try:
+                for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+                    for content in page.get("Contents", []):
+                        batch.append(content['Key'])
+                        if len(batch) == DELETE_BATCH_SIZE:
+                            if len(in_flight) >= workers * 2:
+                                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                                finish(done)
+                            in_flight.add(pool.submit(_delete_batch, s3_client, bucket_name, batch))
+                            count += len(batch)
+                            batch = []
+                if batch:
+                    in_flight.add(pool.submit(_delete_batch, s3_client, bucket_name, batch))
+                    count += len(batch)
+                finish(list(in_flight))
+            finally:
+                for future in in_flight:
+                    future.cancel()
     except ClientError as e:
         logging.error(e)
         return False
-    return True        
+    logging.info(f'Deleted {count - len(failed)} of {count} objects from s3://{bucket_name}/{prefix}')
+    return not failed
 ###############################################################################
 # Delete a bucket.
 ###############################################################################
 def delete_bucket(bucket_name):
     try:
-        s3_client = boto3.client('s3')
+        s3_client = aws_clients.s3_client()
         s3_client.delete_bucket(Bucket=bucket_name)
     except ClientError as e:
         logging.error(e)
@@ -177,7 +462,7 @@ def delete_bucket(bucket_name):
 def create_presigned_url(bucket_name, object_name, expiration=3600):
     
     try:
-        s3_client = boto3.client('s3')
+        s3_client = aws_clients.s3_client()
         Params={'Bucket': bucket_name,'Key': object_name}
         url = s3_client.generate_presigned_url('get_object', Params, 
 ExpiresIn=expiration)
@@ -193,7 +478,7 @@ ExpiresIn=expiration)
 ###############################################################################
 def s3_select(bucket_name, file_name, expression):
     try:
-        s3_client = boto3.client("s3")
+        s3_client = aws_clients.s3_client()
         bucket = bucket_name
         key = file_name
         expression_type = "SQL"
@@ -258,4 +543,5 @@ def main():
 ###############################################################################
 # Exercise the S3 functions.
 ###############################################################################
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
\ No newline at end of file